@@ -0,0 +1,83 @@
+'''
+Headless batch mode: builds structures for scenario files without GUI.
+
+Usage:
+    python batch.py configs/1_circular_movement.yaml configs/debug_cfg.pcl -o results --workers 4
+
+For every scenario `<name>.<ext>.npz` (e.g. `debug_cfg.pcl.npz`) is written to output directory with arrays:
+    coords, controls             -- (time, n, 2) coords and controls of agents
+    parents                      -- (time, n) master of every node (-1 for tree roots)
+    weights                      -- (time, n) connection power of every node to its master
+With `--format mhb` `<name>.<ext>.mhb` (see `storage`) with the same arrays, A, B and settings
+is written instead; it can be opened in GUI or as a scenario again.
+'''
+import os
+import sys
+import time
+import argparse
+import numpy as np
+from core import StructureBuilder
+from scenario import Scenario
+
+
+def result_name(filename, fmt='npz'):
+    # Extension of scenario is kept, so `foo.yaml` and `foo.pcl` don't overwrite results of each other
+    return os.path.basename(filename) + '.' + fmt
+
+
+def run_scenario(filename, output_dir, builder, workers=None, warm_start=None, fmt='npz', sparse=False):
+    scenario = Scenario.load(filename)
+    if workers is not None:
+        scenario.workers = workers
+    if warm_start is not None:
+        scenario.warm_start = warm_start
+    scenario.build_tree_arrays(builder, sparse=sparse)
+    result_filename = os.path.join(output_dir, result_name(filename, fmt))
+    if fmt == 'mhb':
+        scenario.save_binary(result_filename)
+    else:
+        np.savez_compressed(
+            result_filename,
+            coords=scenario.coords,
+            controls=scenario.controls,
+            parents=scenario.parents,
+            weights=scenario.weights,
+        )
+    return scenario, result_filename
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build multiagent hierarchies for scenario files (.yaml, .pcl, .mhb) without GUI')
+    parser.add_argument('scenarios', nargs='+', help='scenario files (.yaml, .pcl, .mhb)')
+    parser.add_argument('-o', '--output', default='.', help='directory for results (default: current)')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='processes to build trees in (default: from scenario)')
+    parser.add_argument('--warm-start', action='store_true', default=None, help="repair every tree from previous moment's one (faster only when agents form separate groups)")
+    parser.add_argument('--sparse', action='store_true', help='keep only connections closer than roupp (needs scipy; less memory for spread agents)')
+    parser.add_argument('-f', '--format', choices=['npz', 'mhb'], default='npz', help='format of results (default: npz)')
+    args = parser.parse_args(argv)
+
+    sources = {}
+    for filename in args.scenarios:
+        sources.setdefault(result_name(filename, args.format), []).append(filename)
+    collisions = [filenames for filenames in sources.values() if len(filenames) > 1]
+    if collisions:
+        parser.error('results of {} would have the same name'.format(', '.join(collisions[0])))
+    os.makedirs(args.output, exist_ok=True)
+    builder = StructureBuilder()
+    failed = 0
+    for filename in args.scenarios:
+        started = time.perf_counter()
+        try:
+            scenario, result_filename = run_scenario(filename, args.output, builder, args.workers, args.warm_start, args.format, args.sparse)
+        except (OSError, ValueError, KeyError) as e:
+            print('{}: error: {}'.format(filename, e), file=sys.stderr)
+            failed += 1
+            continue
+        print('{}: time={} nodes={} -> {} ({:.2f} s)'.format(
+            filename, scenario.time, scenario.nodes_amount, result_filename, time.perf_counter() - started
+        ))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
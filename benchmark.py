@@ -0,0 +1,234 @@
+'''
+Benchmarks of hot paths: connection mxs, tree building (with every combination of features),
+YAML loading and full scenario simulation, for different amounts of agents and moments.
+
+Usage:
+    python benchmark.py -o results.json                           # run and save results
+    python benchmark.py --quick --baseline results.json           # run and compare with saved results
+
+Time of benchmark is the best of several runs, peak memory (by tracemalloc, numpy arrays included)
+is measured in separate run. Results are written as JSON:
+    {'info': {...}, 'results': [{'name', 'params', 'time', 'repeats', 'peak_memory'}, ...]}
+With `--baseline` every result is compared with the same one (by name and params) of baseline file;
+exit code is 1 if any of them is slower than `--threshold` times and by `--min-delta` seconds at least
+(so noise of sub-millisecond benchmarks is not a regression).
+Whole scenarios (YAML, simulation) are run only up to `--max-cells` (n * n * time) and
+`--max-agent-moments` (n * time), else they take hours and gigabytes.
+'''
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import itertools
+import tempfile
+import tracemalloc
+import numpy as np
+from core import StructureBuilder, Utils
+from history import History
+from scenario import Scenario
+
+SIZES = (10, 100, 1000, 5000)
+TIMES = (10, 100, 1000, 10000)
+QUICK_SIZES = (10, 100, 1000)
+QUICK_TIMES = (10, 100)
+# Feature values of build_tree benchmarks (the first ones switch features off)
+RECALCULATE_PROBS = (False, True)
+MAX_SLAVES = (0, 3)
+MAX_DEPTH = (0, 4)
+# Scenario settings
+ROLOW = 5.0
+ROUPP = 100.0
+FUNC = 'cos(ax+b)'
+# Agents are spread with that mean distance to neighbours (so trees are not trivial)
+SPACING = 30.0
+DEFAULT_REPEAT = 5
+# Fast benchmarks are repeated while their total time is less
+MIN_TOTAL_TIME = 0.5  # seconds
+DEFAULT_MAX_CELLS = 10**8
+DEFAULT_MAX_AGENT_MOMENTS = 2 * 10**5
+DEFAULT_THRESHOLD = 1.25
+DEFAULT_MIN_DELTA = 0.005  # seconds
+NAMES = ('connection_probability', 'connection_power', 'build_tree', 'load_yaml', 'simulation')
+
+
+def agents(n, seed=0):
+    '''
+    Coords and controls of `n` agents scattered over square
+    '''
+    rng = np.random.default_rng(seed)
+    coords = rng.random((n, 2)) * SPACING * np.sqrt(n)
+    # Slow movement, so agents stay connected for thousands of moments
+    controls = rng.normal(scale=0.01, size=(n, 2))
+    return coords, controls
+
+
+def write_yaml(filename, coords, controls):
+    '''
+    Write scenario of (time, n, 2) `coords` and `controls` in format of configs/*.yaml
+    (as GUI saves it), faster than yaml.dump
+    '''
+    with open(filename, 'w') as f:
+        f.write('settings:\n    max_sub_nodes: 0\n    max_tree_depth: 0\n    prob_depending: false\n')
+        f.write('    rolow: {}\n    roupp: {}\n    smoothing_function: {}\nstructure:\n'.format(ROLOW, ROUPP, FUNC))
+        for t in range(len(coords)):
+            f.write('    {}:\n'.format(t))
+            for key, vectors in (('controls', controls[t]), ('coordinates', coords[t])):
+                f.write('        {}:\n'.format(key))
+                for i, (x, y) in enumerate(vectors):
+                    f.write('            {}:\n            - {!r}\n            - {!r}\n'.format(i, float(x), float(y)))
+
+
+def simulate(coords, controls, time_amount):
+    '''
+    Whole scenario as in GUI: movement of agents and structures of all moments (see `History.build`)
+    '''
+    eye = np.broadcast_to(np.eye(2), (len(coords), 2, 2))
+    history = History(time_amount, len(coords))
+    try:
+        history.set_agents(*Utils.simulate(coords, controls, eye, eye, time_amount), eye, eye)
+        history.build(ROLOW, ROUPP, FUNC)
+    finally:
+        history.close()
+
+
+def measure(func, repeat=DEFAULT_REPEAT):
+    '''
+    Best time of `func()` (of `repeat` runs at most) and peak memory allocated by it.
+    Returns (time, repeats, peak_memory)
+    '''
+    times = []
+    while len(times) < repeat and (not times or sum(times) < MIN_TOTAL_TIME):
+        started = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - started)
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return min(times), len(times), peak
+
+
+def benchmarks(sizes, times, names=None, max_cells=DEFAULT_MAX_CELLS, max_agent_moments=DEFAULT_MAX_AGENT_MOMENTS):
+    '''
+    Generate (name, params, func) of benchmarks (all of them or with `names` only); data is
+    prepared lazily, so only data of current benchmark is kept in memory
+    '''
+    def wanted(name):
+        return names is None or name in names
+
+    builder = StructureBuilder()
+    for n in sizes:
+        if not (wanted('connection_probability') or wanted('connection_power') or wanted('build_tree')):
+            break
+        coords, controls = agents(n)
+        if wanted('connection_probability'):
+            yield 'connection_probability', {'n': n}, lambda: builder.connection_probability(coords, ROLOW, ROUPP, FUNC)
+        cprob = builder.connection_probability(coords, ROLOW, ROUPP, FUNC)
+        if wanted('connection_power'):
+            yield 'connection_power', {'n': n}, lambda: builder.connection_power(cprob)
+        if not wanted('build_tree'):
+            continue
+        for recalculate_probs, max_slaves, max_depth in itertools.product(RECALCULATE_PROBS, MAX_SLAVES, MAX_DEPTH):
+            params = {'n': n, 'recalculate_probs': recalculate_probs, 'max_slaves': max_slaves, 'max_depth': max_depth}
+            kwargs = dict(params)
+            del kwargs['n']
+            yield 'build_tree', params, lambda: builder.build_tree(cprob, as_parents=True, **kwargs)
+    for n, time_amount in itertools.product(sizes, times):
+        coords, controls = agents(n)
+        eye = np.broadcast_to(np.eye(2), (n, 2, 2))
+        if wanted('load_yaml') and n * time_amount <= max_agent_moments:
+            scenario = Scenario.from_initial_state(coords, controls, eye, eye, time_amount)
+            fd, filename = tempfile.mkstemp(suffix='.yaml')
+            os.close(fd)
+            try:
+                write_yaml(filename, scenario.coords, scenario.controls)
+                yield 'load_yaml', {'n': n, 'time': time_amount}, lambda: Scenario.from_yaml(filename)
+            finally:
+                os.remove(filename)
+        if wanted('simulation') and n * n * time_amount <= max_cells:
+            yield 'simulation', {'n': n, 'time': time_amount}, lambda: simulate(coords, controls, time_amount)
+
+
+def key(result):
+    return result['name'], json.dumps(result['params'], sort_keys=True)
+
+
+def describe(result):
+    return '{} {}'.format(result['name'], ' '.join('{}={}'.format(name, value) for name, value in result['params'].items()))
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD, min_delta=DEFAULT_MIN_DELTA):
+    '''
+    Print ratio of times of `results` to the same ones of `baseline`.
+    Returns list of results which are slower than `threshold` times and by `min_delta` seconds at least
+    '''
+    baseline = {key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        old = baseline.get(key(result))
+        if old is None:
+            print('{:<70} {:>10.4f} s   (no baseline)'.format(describe(result), result['time']))
+            continue
+        ratio = result['time'] / old['time'] if old['time'] > 0 else float('inf')
+        mark = ''
+        if ratio > threshold and result['time'] - old['time'] >= min_delta:
+            regressions.append(result)
+            mark = '  REGRESSION'
+        print('{:<70} {:>10.4f} s   x{:.2f} (was {:.4f} s, memory {:+.1f} MiB){}'.format(
+            describe(result), result['time'], ratio, old['time'], (result['peak_memory'] - old['peak_memory']) / 2**20, mark
+        ))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark connection mxs, tree building, YAML loading and simulation')
+    parser.add_argument('-o', '--output', default='benchmark_results.json', help='results file (default: %(default)s)')
+    parser.add_argument('--baseline', default=None, help='results file to compare with')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='slowdown treated as regression (default: %(default)s)')
+    parser.add_argument('--min-delta', type=float, default=DEFAULT_MIN_DELTA, help='smaller slowdown (seconds) is never treated as regression (default: %(default)s)')
+    parser.add_argument('--quick', action='store_true', help='sizes {} and times {} only'.format(QUICK_SIZES, QUICK_TIMES))
+    parser.add_argument('--sizes', type=int, nargs='+', default=None, help='amounts of agents (default: {})'.format(SIZES))
+    parser.add_argument('--times', type=int, nargs='+', default=None, help='amounts of moments (default: {})'.format(TIMES))
+    parser.add_argument('--only', nargs='+', default=None, choices=NAMES, help='run only these benchmarks')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='runs of fast benchmarks (default: %(default)s)')
+    parser.add_argument('--max-cells', type=float, default=DEFAULT_MAX_CELLS, help='max n*n*time of simulation (default: %(default)g)')
+    parser.add_argument('--max-agent-moments', type=float, default=DEFAULT_MAX_AGENT_MOMENTS, help='max n*time of YAML (default: %(default)g)')
+    args = parser.parse_args(argv)
+
+    sizes = args.sizes or (QUICK_SIZES if args.quick else SIZES)
+    times = args.times or (QUICK_TIMES if args.quick else TIMES)
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+    results = []
+    for name, params, func in benchmarks(sizes, times, args.only, args.max_cells, args.max_agent_moments):
+        elapsed, repeats, peak = measure(func, args.repeat)
+        results.append({'name': name, 'params': params, 'time': elapsed, 'repeats': repeats, 'peak_memory': peak})
+        print('{:<70} {:>10.4f} s {:>10.1f} MiB'.format(describe(results[-1]), elapsed, peak / 2**20), flush=True)
+    info = {
+        'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpus': os.cpu_count(),
+    }
+    with open(args.output, 'w') as f:
+        json.dump({'info': info, 'results': results}, f, indent=4)
+    print('results -> {}'.format(args.output))
+    if baseline is not None:
+        print('\ncomparison with {}:'.format(args.baseline))
+        regressions = compare(results, baseline, args.threshold, args.min_delta)
+        if regressions:
+            print('{} regression(s)'.format(len(regressions)))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
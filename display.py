@@ -0,0 +1,480 @@
+import time
+from PyQt5 import QtCore, QtWidgets
+from matplotlib.backends.backend_qt5agg import (NavigationToolbar2QT as NavigationToolbar)
+from core import Utils
+from history import History, DEFAULT_IN_MEMORY_LIMIT
+from renderer import GraphRenderer, HeatmapRenderer
+from layouts import LayoutCache
+from models import ArrayModel, ConnectionModel
+import forms.display_structure as forms_display
+
+DEFAULT_ROUND_DIGIT = 4
+# Scenarios of that many moments (and longer) are calculated lazily: moment by moment when they are shown;
+# so are scenarios which connection mxs of all moments are bigger than `history.DEFAULT_IN_MEMORY_LIMIT`
+DEFAULT_LAZY_FROM_TIME = 1000
+# Progress of building is shown that many times at least
+DEFAULT_PROGRESS_STEPS = 100
+# Playback: that many moments are calculated ahead of shown one; prefetching thread waits that long when it is ahead
+DEFAULT_PLAYBACK_AHEAD = 30
+PREFETCH_IDLE_MS = 5
+# Width (pixels) of columns of connection mxs tables (fits value of DEFAULT_ROUND_DIGIT digits)
+DEFAULT_CONN_COLUMN_WIDTH = 60
+
+
+# Building structures for all moments out of GUI thread
+class BuildThread(QtCore.QThread):
+    # amount of moments built (they are built one after another from 0)
+    progress = QtCore.pyqtSignal(int)
+
+    def __init__(self, history, *args, parent=None, **kwargs):
+        QtCore.QThread.__init__(self, parent)
+        self.history = history
+        self.args = args
+        self.kwargs = kwargs
+        self.cancelled = False
+        self.error = None
+
+    def run(self):
+        chunk = max(1, self.history.time // DEFAULT_PROGRESS_STEPS)
+        builds = self.history.iter_build(*self.args, chunk=chunk, **self.kwargs)
+        try:
+            for built in builds:
+                self.progress.emit(built)
+                if self.cancelled:
+                    return
+        except Exception as e:
+            # Exception must not escape QThread.run (PyQt aborts then), it is shown by display window
+            self.error = str(e) or type(e).__name__
+        finally:
+            builds.close()
+
+    def cancel(self):
+        self.cancelled = True
+
+
+# Calculating moments (trees, connection mxs, layouts) out of GUI thread: shown moment
+# and its neighbours in lazy mode, moments ahead of playback
+class PrefetchThread(QtCore.QThread):
+    # moment which is calculated (and not calculated before)
+    calculated = QtCore.pyqtSignal(int)
+
+    def __init__(self, history, layouts, layout, parent=None):
+        QtCore.QThread.__init__(self, parent)
+        self.history = history
+        self.layouts = layouts
+        self.layout = layout
+        # Moments from `next` to `last` are to be calculated
+        self.next = 0
+        self.last = -1
+        self.cancelled = False
+
+    def follow(self, first, last):
+        # Window starts from `first` anew every time, so seeking backwards is followed too
+        # (moments which are ready already are skipped quickly)
+        self.next = first
+        self.last = last
+
+    def run(self):
+        while not self.cancelled:
+            t = self.next
+            if t > self.last:
+                self.msleep(PREFETCH_IDLE_MS)
+                continue
+            self.next = t + 1
+            if self.history.ready(t) and self.layouts.ready(t, self.layout):
+                continue
+            tree = self.history.tree(t)
+            self.history.conn_prob(t)
+            self.layouts.get(t, self.layout, tree, self.history.coords[t])
+            self.calculated.emit(t)
+
+    def cancel(self):
+        self.cancelled = True
+
+
+# Displaying structure window
+class DisplayWin(QtWidgets.QMainWindow):
+    def __init__(self, parent=None):
+        # Base
+        QtWidgets.QWidget.__init__(self, parent)
+        self.ui = forms_display.Ui_MainWindow()
+        self.ui.setupUi(self)
+        # Matplotlib Toolbar
+        self.addToolBar(NavigationToolbar(self.ui.widget__displayGraph.canvas, self))
+        self.renderer = GraphRenderer(self.ui.widget__displayGraph.canvas.axes, round_digit=DEFAULT_ROUND_DIGIT)
+        self.layouts = LayoutCache()
+        self.heatmap_renderer = HeatmapRenderer(self.ui.widget__displayHeatmap.canvas.axes)
+        # Table models (views read only visible cells from arrays of current moment)
+        self.coords_model = ArrayModel(['x', 'y'], round_digit=DEFAULT_ROUND_DIGIT, parent=self)
+        self.controls_model = ArrayModel(['x', 'y'], round_digit=DEFAULT_ROUND_DIGIT, parent=self)
+        self.conn_probs_model = ConnectionModel(round_digit=DEFAULT_ROUND_DIGIT, parent=self)
+        self.conn_powers_model = ConnectionModel(round_digit=DEFAULT_ROUND_DIGIT, parent=self)
+        self.ui.tableView__displayx.setModel(self.coords_model)
+        self.ui.tableView__displayu.setModel(self.controls_model)
+        self.ui.tableView__displayConnProb.setModel(self.conn_probs_model)
+        self.ui.tableView__displayConnPower.setModel(self.conn_powers_model)
+        # n x n tables are never fitted to contents (it formats every cell): their columns are of fixed width
+        for view in (self.ui.tableView__displayConnProb, self.ui.tableView__displayConnPower):
+            header = view.horizontalHeader()
+            header.setSectionResizeMode(QtWidgets.QHeaderView.Fixed)
+            header.setDefaultSectionSize(DEFAULT_CONN_COLUMN_WIDTH)
+        # Vars
+        self.current_time = 0
+        self.history = None
+        self.build_thread = None
+        self.built_moments = 0
+        # Progress of building (in statusbar)
+        self.progressBar__build = QtWidgets.QProgressBar()
+        self.pushButton__cancelBuild = QtWidgets.QPushButton('Отмена')
+        self.ui.statusbar.addPermanentWidget(self.progressBar__build)
+        self.ui.statusbar.addPermanentWidget(self.pushButton__cancelBuild)
+        self.progressBar__build.hide()
+        self.pushButton__cancelBuild.hide()
+        self.selected_layout = self.ui.comboBox__layoutSelect.currentText()
+        # Playback (frame is chosen by clock, so slow moments are skipped instead of slowing it down)
+        self.play_timer = QtCore.QTimer(self)
+        self.play_timer.setTimerType(QtCore.Qt.PreciseTimer)
+        self.prefetch_thread = None
+        self.play_from = 0
+        self.play_started = 0.0
+        self.dropped_frames = 0
+        # Connects setup
+        self.initConnects()
+
+    def initConnects(self):
+        self.ui.horizontalSlider__currentTime.valueChanged.connect(self.set_time_by_scrollbar)
+        self.ui.spinBox__currentTime.valueChanged.connect(self.set_time_by_spinbox)
+        self.ui.comboBox__layoutSelect.activated[str].connect(self.set_selected_layout)
+        self.pushButton__cancelBuild.clicked.connect(self.cancel_build)
+        self.ui.tabWidget__right.currentChanged.connect(self.syncHeatmap)
+        self.ui.comboBox__heatmapSelect.activated.connect(self.syncHeatmap)
+        self.ui.pushButton__play.clicked.connect(self.toggle_playback)
+        self.ui.spinBox__fps.valueChanged.connect(self.set_fps)
+        self.play_timer.timeout.connect(self.play_step)
+
+    def prepareWidgets(self):
+        # Only built moments can be chosen (more of them become available while building)
+        last_time = max(self.available_time() - 1, 0)
+        self.ui.horizontalSlider__currentTime.setMaximum(last_time)
+        self.ui.spinBox__currentTime.setMaximum(last_time)
+
+    def available_time(self):
+        if self.history is None:
+            return 0
+        if self.history.lazy:
+            return self.history.time
+        return self.built_moments
+
+    def syncWidgets(self):
+        if self.current_time >= self.available_time():
+            # Current moment is not built yet, widgets are synced when it will be
+            return
+        if self.history.lazy and not self.moment_ready(self.current_time):
+            # Moment is calculated by prefetching thread, widgets are synced when it is ready
+            self.ui.statusbar.showMessage('Вычисление момента времени {}...'.format(self.current_time))
+            self.prefetch_thread.follow(self.current_time, self.current_time)
+            return
+        self.syncNodeCoordsTable()
+        self.syncNodeControlsTable()
+        self.syncConnectionProbsTable()
+        self.syncConnectionPowersTable()
+        self.syncGraph()
+        self.syncHeatmap()
+        # Neighbour moments are calculated in background (lazy mode)
+        self.prefetch()
+        #print('Overall weight = ', self.history.tree(self.current_time).weight())
+
+    def syncNodeCoordsTable(self):
+        # coords
+        self.sync_table(self.ui.tableView__displayx, self.coords_model, self.history.coords[self.current_time])
+
+    def syncNodeControlsTable(self):
+        self.sync_table(self.ui.tableView__displayu, self.controls_model, self.history.controls[self.current_time])
+
+    def syncConnectionProbsTable(self):
+        # tree connections are highlighted (j is slave of i <=> parents[j] == i)
+        parents = self.history.tree(self.current_time).parents
+        self.sync_table(self.ui.tableView__displayConnProb, self.conn_probs_model, self.history.conn_prob(self.current_time), parents, fit=False)
+
+    def syncConnectionPowersTable(self):
+        # tree connections are highlighted (j is slave of i <=> parents[j] == i)
+        parents = self.history.tree(self.current_time).parents
+        self.sync_table(self.ui.tableView__displayConnPower, self.conn_powers_model, self.history.conn_power(self.current_time), parents, fit=False)
+
+    @staticmethod
+    def sync_table(view, model, *args, fit=True):
+        # Only visible cells are formatted (by view); columns are fitted when table shape is changed only
+        # (fitting formats all cells, so columns of n x n tables are not fitted, see __init__)
+        if model.set_array(*args) and fit:
+            view.resizeColumnsToContents()
+
+    def syncGraph(self):
+        # graphs
+        tree = self.history.tree(self.current_time)
+        # Positions of nodes by self.selected_layout (calculated once for every moment)
+        pos = self.layouts.get(self.current_time, self.selected_layout, tree, self.history.coords[self.current_time])
+        # And draw the graph (only changed data is redrawn)
+        self.renderer.update(pos, tree)
+
+    def syncHeatmap(self):
+        # Image is updated only when it is visible (and on switching to it)
+        if self.ui.tabWidget__right.currentWidget() is not self.ui.tab__displayHeatmap:
+            return
+        if not self.shown_ready():
+            return
+        tree = self.history.tree(self.current_time)
+        if self.ui.comboBox__heatmapSelect.currentIndex() == 0:
+            matrix = self.history.conn_prob(self.current_time)
+        else:
+            matrix = self.history.conn_power(self.current_time)
+        self.heatmap_renderer.update(matrix, tree)
+
+    @staticmethod
+    def lazy_for(time, nodes_amount):
+        # Connection mxs of all moments are kept in eager mode only, so wide scenarios are lazy even if short
+        conn_probs_size = time * nodes_amount**2 * 8
+        return time >= DEFAULT_LAZY_FROM_TIME or conn_probs_size > DEFAULT_IN_MEMORY_LIMIT
+
+    def new_history(self, time, nodes_amount):
+        return History(time, nodes_amount, lazy=self.lazy_for(time, nodes_amount))
+
+    def prefetch(self):
+        # While playing moments ahead are calculated instead (see `play_step`)
+        if self.history.lazy and self.prefetch_thread is not None and not self.playing():
+            t = self.current_time
+            self.prefetch_thread.follow(max(0, t - 1), min(t + 1, self.history.time - 1))
+
+    def start_prefetching(self):
+        if self.prefetch_thread is None:
+            self.prefetch_thread = PrefetchThread(self.history, self.layouts, self.selected_layout, parent=self)
+            self.prefetch_thread.calculated.connect(self.moment_calculated)
+            self.prefetch_thread.start()
+
+    def stop_prefetching(self):
+        if self.prefetch_thread is not None:
+            self.prefetch_thread.cancel()
+            self.prefetch_thread.wait()
+            self.prefetch_thread = None
+
+    def moment_calculated(self, t):
+        if self.sender() is not self.prefetch_thread:
+            # moment of released history
+            return
+        # While playing moments are shown by clock (see `play_step`)
+        if t == self.current_time and not self.playing():
+            self.ui.statusbar.clearMessage()
+            self.syncWidgets()
+
+    def build_from_scenario(self, scenario):
+        '''
+        Build structures for loaded scenario; its arrays (e.g. memory maps of .mhb) are used
+        without copying, its trees (`scenario.parents`), if any, are not rebuilt
+        '''
+        self.clear_history()
+        # With saved trees nothing is left to build, connection mxs are calculated for shown moments only
+        lazy = scenario.parents is not None or self.lazy_for(len(scenario.coords), scenario.nodes_amount)
+        self.history = History.from_scenario(scenario, lazy=lazy)
+        self.build_structures()
+
+    def build_structure_for_ever(self):
+        self.clear_history()
+        self.history = self.new_history(self.time, self.nodes_amount)
+        # Calculating coords and controls for every time (all agents at once)
+        # NOTE: placeholder, cause A, B does not change now
+        history_coords, history_controls = Utils.simulate(self.node_coords, self.node_controls, self.A, self.B, self.time)
+        self.history.set_agents(history_coords, history_controls, self.A, self.B)
+        # Building structures for every time
+        self.build_structures()
+
+    def build_structures(self):
+        # Connection mxs are calculated for many moments at once, trees are built
+        # one by one (or in `workers` processes) in background thread;
+        # in lazy mode moments are calculated when shown
+        args = (self.rolow, self.roupp, self.smoothing_function)
+        kwargs = dict(
+            workers=self.workers,
+            warm_start=self.warm_start,
+            recalculate_probs=self.prob_depending,
+            max_slaves=self.max_sub_nodes,
+            max_depth=self.max_tree_depth
+        )
+        if self.history.lazy:
+            # Moments are calculated in prefetching thread (see `syncWidgets`)
+            self.history.build(*args, **kwargs)
+            self.start_prefetching()
+            return
+        self.built_moments = 0
+        self.build_thread = BuildThread(self.history, *args, parent=self, **kwargs)
+        self.build_thread.progress.connect(self.build_progress)
+        self.build_thread.finished.connect(self.build_finished)
+        self.progressBar__build.setRange(0, self.history.time)
+        self.progressBar__build.setValue(0)
+        self.progressBar__build.show()
+        self.pushButton__cancelBuild.show()
+        self.ui.statusbar.showMessage('Построение структур...')
+        self.build_thread.start()
+
+    def build_progress(self, built):
+        if self.build_thread is None or self.sender() is not self.build_thread:
+            # progress of cancelled build
+            return
+        first_shown = self.built_moments <= self.current_time < built
+        self.built_moments = built
+        self.progressBar__build.setValue(built)
+        self.prepareWidgets()
+        if first_shown:
+            self.syncWidgets()
+
+    def build_finished(self):
+        if self.build_thread is None or self.sender() is not self.build_thread:
+            return
+        error = self.build_thread.error
+        if error is not None:
+            self.ui.statusbar.showMessage('Ошибка построения: построено {} из {} моментов времени'.format(
+                self.built_moments, self.history.time
+            ))
+        elif self.built_moments < self.history.time:
+            self.ui.statusbar.showMessage('Построение остановлено: построено {} из {} моментов времени'.format(
+                self.built_moments, self.history.time
+            ))
+        else:
+            self.ui.statusbar.clearMessage()
+        self.build_thread = None
+        self.progressBar__build.hide()
+        self.pushButton__cancelBuild.hide()
+        if error is not None:
+            self.error_message(error)
+
+    def error_message(self, text):
+        warning_msg = QtWidgets.QMessageBox(self)
+        warning_msg.setWindowTitle('Ошибка')
+        warning_msg.setText(text)
+        warning_msg.exec_()
+
+    def cancel_build(self):
+        if self.build_thread is not None:
+            self.build_thread.cancel()
+
+    def clear_history(self):
+        # Running build, playback and prefetching are stopped before their history is released
+        self.stop_playback()
+        self.stop_prefetching()
+        if self.build_thread is not None:
+            self.build_thread.cancel()
+            self.build_thread.wait()
+            self.build_thread = None
+            self.progressBar__build.hide()
+            self.pushButton__cancelBuild.hide()
+        self.built_moments = 0
+        self.layouts.clear()
+        if self.history is not None:
+            self.history.close()
+            self.history = None
+
+    def set_time_by_scrollbar(self):
+        self.set_time(int(self.ui.horizontalSlider__currentTime.value()))
+        self.restart_clock()
+
+    def set_time_by_spinbox(self):
+        self.set_time(int(self.ui.spinBox__currentTime.value()))
+        self.restart_clock()
+
+    def set_time(self, t):
+        # Slider and spinbox are moved together, widgets are synced once
+        self.current_time = t
+        for widget in (self.ui.horizontalSlider__currentTime, self.ui.spinBox__currentTime):
+            widget.blockSignals(True)
+            widget.setValue(t)
+            widget.blockSignals(False)
+        self.syncWidgets()
+
+    def moment_ready(self, t):
+        return self.history.ready(t) and self.layouts.ready(t, self.selected_layout)
+
+    def shown_ready(self):
+        # True if current moment can be shown without calculation in GUI thread
+        if self.current_time >= self.available_time():
+            return False
+        return not self.history.lazy or self.moment_ready(self.current_time)
+
+    def playing(self):
+        return self.ui.pushButton__play.isChecked()
+
+    def toggle_playback(self, checked):
+        if checked:
+            self.start_playback()
+        else:
+            self.stop_playback()
+
+    def start_playback(self):
+        if self.history is None or self.available_time() < 2:
+            self.ui.pushButton__play.setChecked(False)
+            return
+        if self.current_time >= self.history.time - 1:
+            self.set_time(0)
+        self.dropped_frames = 0
+        self.start_prefetching()
+        self.prefetch_thread.follow(self.current_time + 1, min(self.current_time + DEFAULT_PLAYBACK_AHEAD, self.available_time() - 1))
+        self.ui.pushButton__play.setChecked(True)
+        self.ui.pushButton__play.setText('Пауза')
+        # Weights change every frame, so they are drawn on pause only
+        self.renderer.show_edge_labels = False
+        self.set_fps()
+
+    def stop_playback(self):
+        self.play_timer.stop()
+        # In lazy mode prefetching thread keeps calculating shown moments
+        if self.history is None or not self.history.lazy:
+            self.stop_prefetching()
+        self.ui.pushButton__play.setChecked(False)
+        self.ui.pushButton__play.setText('Воспроизвести')
+        if not self.renderer.show_edge_labels:
+            self.renderer.show_edge_labels = True
+            if self.shown_ready():
+                self.syncGraph()
+        if self.history is not None:
+            self.prefetch()
+
+    def closeEvent(self, event):
+        self.stop_playback()
+        self.stop_prefetching()
+        QtWidgets.QMainWindow.closeEvent(self, event)
+
+    def set_fps(self):
+        if not self.playing():
+            return
+        self.play_timer.start(max(1, round(1000 / self.ui.spinBox__fps.value())))
+        self.restart_clock()
+
+    def restart_clock(self):
+        # Playback goes on from current moment
+        self.play_from = self.current_time
+        self.play_started = time.perf_counter()
+
+    def play_step(self):
+        if self.current_time >= self.history.time - 1:
+            self.stop_playback()
+            return
+        last = self.available_time() - 1
+        # Moment which should be shown now (moments beyond built ones are waited for)
+        target = self.play_from + int((time.perf_counter() - self.play_started) * self.ui.spinBox__fps.value())
+        target = min(target, last)
+        self.prefetch_thread.follow(target + 1, min(target + DEFAULT_PLAYBACK_AHEAD, last))
+        # The latest calculated moment up to target is shown, so UI never waits for calculation:
+        # if it falls behind, moments are dropped
+        for t in range(target, max(self.current_time, target - DEFAULT_PLAYBACK_AHEAD), -1):
+            if self.moment_ready(t):
+                self.dropped_frames += t - self.current_time - 1
+                self.set_time(t)
+                break
+        if self.dropped_frames:
+            self.ui.statusbar.showMessage('Пропущено кадров: {}'.format(self.dropped_frames))
+
+    def set_selected_layout(self):
+        self.selected_layout = self.ui.comboBox__layoutSelect.currentText()
+        if self.prefetch_thread is not None:
+            # Positions of upcoming moments are calculated anew
+            self.prefetch_thread.layout = self.selected_layout
+            self.prefetch_thread.next = self.current_time + 1
+        self.renderer.reset_view()
+        self.syncWidgets()
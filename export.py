@@ -0,0 +1,156 @@
+'''
+Offscreen export of hierarchy animation: tree of every moment is drawn (as in graph of DisplayWin)
+with Agg backend to PNG frames, which are encoded to video if ffmpeg is installed.
+
+Usage:
+    python export.py configs/1_circular_movement.yaml -o frames --video hierarchy.mp4 --workers 4
+
+Frames are `frame_<moment>.png` in output directory. Trees saved in scenario (e.g. .mhb written by
+`batch.py --format mhb`) are drawn as they are, otherwise they are built first.
+Moments are split into contiguous ranges which are drawn in worker processes; every worker creates
+figure once and then only changes data of its artists (see `renderer.GraphRenderer`).
+Spring layout of every moment starts from positions of previous one, so its positions are calculated
+in main process moment after moment before drawing; frames don't depend on amount of workers.
+'''
+import os
+import sys
+import time
+import shutil
+import argparse
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.image import imsave
+from core import Tree
+from layouts import LayoutCache, CARTESIAN, CIRCULAR, PLANAR, SHELL, SPRING
+from renderer import GraphRenderer
+from scenario import Scenario
+
+FRAME_PATTERN = 'frame_{:06d}.png'
+# ffmpeg's pattern for the same names
+FFMPEG_PATTERN = 'frame_%06d.png'
+DEFAULT_SIZE = (640, 480)  # pixels
+DEFAULT_DPI = 100
+DEFAULT_FPS = 10
+DEFAULT_ROUND_DIGIT = 4
+# Moments are split into that many ranges per worker (so workers finish at about the same time)
+CHUNKS_PER_WORKER = 4
+# Layouts by names of command line
+LAYOUTS = {'cartesian': CARTESIAN, 'planar': PLANAR, 'circular': CIRCULAR, 'shell': SHELL, 'spring': SPRING}
+
+
+def _render_job(job):
+    # Executed in worker process of `export_frames`
+    start, coords, parents, weights, positions, output_dir, layout, view, size, dpi = job
+    figure = Figure(figsize=(size[0] / dpi, size[1] / dpi), dpi=dpi)
+    canvas = FigureCanvasAgg(figure)
+    renderer = GraphRenderer(figure.add_subplot(111), round_digit=DEFAULT_ROUND_DIGIT)
+    renderer.set_view(*view)
+    layouts = LayoutCache()
+    filenames = []
+    for i in range(len(parents)):
+        t = start + i
+        tree = Tree(parents[i], weights[i])
+        pos = positions[i] if positions is not None else layouts.get(t, layout, tree, coords[i])
+        renderer.update(pos, tree)
+        filename = os.path.join(output_dir, FRAME_PATTERN.format(t))
+        imsave(filename, np.asarray(canvas.buffer_rgba()))
+        filenames.append(filename)
+    return filenames
+
+
+def export_frames(coords, parents, weights, output_dir, layout=CARTESIAN, workers=None, size=DEFAULT_SIZE, dpi=DEFAULT_DPI):
+    '''
+    Draw trees (`parents`, `weights` -- (time, n) arrays) of agents at `coords` ((time, n, 2))
+    in `layout` to PNG files in `output_dir`, using `workers` processes (default: all CPUs).
+    View is the same in all frames. Returns list of filenames in order of moments
+    '''
+    os.makedirs(output_dir, exist_ok=True)
+    time_amount = len(parents)
+    workers = workers or os.cpu_count() or 1
+    if layout == CARTESIAN:
+        view = (coords.reshape(-1, coords.shape[-1]).min(axis=0), coords.reshape(-1, coords.shape[-1]).max(axis=0))
+    else:
+        # networkx layouts are scaled to [-1, 1]
+        view = ((-1.0, -1.0), (1.0, 1.0))
+    positions = None
+    if layout == SPRING:
+        # Moment depends on previous one (see `LayoutCache`), so they can't be split between workers
+        layouts = LayoutCache()
+        positions = np.array([layouts.get(t, layout, Tree(parents[t], weights[t])) for t in range(time_amount)])
+    chunks = min(time_amount, workers * CHUNKS_PER_WORKER)
+    bounds = np.linspace(0, time_amount, chunks + 1).astype(int)
+    jobs = [
+        (
+            start, np.asarray(coords[start:stop]), np.asarray(parents[start:stop]), np.asarray(weights[start:stop]),
+            None if positions is None else positions[start:stop], output_dir, layout, view, size, dpi,
+        )
+        for start, stop in zip(bounds[:-1], bounds[1:])
+    ]
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_render_job, jobs))
+    else:
+        results = [_render_job(job) for job in jobs]
+    return [filename for filenames in results for filename in filenames]
+
+
+def encode_video(frames_dir, filename, fps=DEFAULT_FPS):
+    '''
+    Encode frames written by `export_frames` to video `filename` with ffmpeg.
+    Returns False if ffmpeg is not found
+    '''
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg is None:
+        return False
+    subprocess.run([
+        ffmpeg, '-y', '-loglevel', 'error', '-framerate', str(fps), '-i', os.path.join(frames_dir, FFMPEG_PATTERN),
+        # Most players need yuv420p, which needs even width and height
+        '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', '-pix_fmt', 'yuv420p', filename,
+    ], check=True)
+    return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Draw hierarchy of every moment of scenario (.yaml, .pcl, .mhb) to PNG frames or video')
+    parser.add_argument('scenario', help='scenario file (.yaml, .pcl, .mhb)')
+    parser.add_argument('-o', '--output', default='frames', help='directory for frames (default: frames)')
+    parser.add_argument('-l', '--layout', choices=list(LAYOUTS), default='cartesian', help='layout of nodes (default: cartesian)')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='processes to draw in (default: all CPUs)')
+    parser.add_argument('--size', default='{}x{}'.format(*DEFAULT_SIZE), help='frame size in pixels, WIDTHxHEIGHT (default: %(default)s)')
+    parser.add_argument('--dpi', type=int, default=DEFAULT_DPI, help='dots per inch (default: %(default)s)')
+    parser.add_argument('--video', default=None, help='encode frames to this video file (needs ffmpeg)')
+    parser.add_argument('--fps', type=int, default=DEFAULT_FPS, help='frames per second of video (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    try:
+        size = tuple(int(value) for value in args.size.lower().split('x'))
+        if len(size) != 2:
+            raise ValueError
+    except ValueError:
+        parser.error('size must be WIDTHxHEIGHT, e.g. 640x480')
+    started = time.perf_counter()
+    try:
+        scenario = Scenario.load(args.scenario)
+    except (OSError, ValueError, KeyError) as e:
+        print('{}: error: {}'.format(args.scenario, e), file=sys.stderr)
+        return 1
+    if scenario.parents is None:
+        scenario.build_tree_arrays()
+    filenames = export_frames(
+        scenario.coords, scenario.parents, scenario.weights, args.output,
+        layout=LAYOUTS[args.layout], workers=args.workers, size=size, dpi=args.dpi
+    )
+    print('{}: {} frames -> {} ({:.2f} s)'.format(args.scenario, len(filenames), args.output, time.perf_counter() - started))
+    if args.video is not None:
+        if encode_video(args.output, args.video, args.fps):
+            print('video -> {}'.format(args.video))
+        else:
+            print('ffmpeg is not found, only frames are written', file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
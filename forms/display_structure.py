@@ -27,19 +27,15 @@ class Ui_MainWindow(object):
         self.tabWidget__left.setObjectName("tabWidget__left")
         self.tab__displayx = QtWidgets.QWidget()
         self.tab__displayx.setObjectName("tab__displayx")
-        self.tableWidget__displayx = QtWidgets.QTableWidget(self.tab__displayx)
-        self.tableWidget__displayx.setGeometry(QtCore.QRect(10, 10, 151, 451))
-        self.tableWidget__displayx.setObjectName("tableWidget__displayx")
-        self.tableWidget__displayx.setColumnCount(0)
-        self.tableWidget__displayx.setRowCount(0)
+        self.tableView__displayx = QtWidgets.QTableView(self.tab__displayx)
+        self.tableView__displayx.setGeometry(QtCore.QRect(10, 10, 151, 451))
+        self.tableView__displayx.setObjectName("tableView__displayx")
         self.tabWidget__left.addTab(self.tab__displayx, "")
         self.tab__displayu = QtWidgets.QWidget()
         self.tab__displayu.setObjectName("tab__displayu")
-        self.tableWidget__displayu = QtWidgets.QTableWidget(self.tab__displayu)
-        self.tableWidget__displayu.setGeometry(QtCore.QRect(10, 10, 151, 451))
-        self.tableWidget__displayu.setObjectName("tableWidget__displayu")
-        self.tableWidget__displayu.setColumnCount(0)
-        self.tableWidget__displayu.setRowCount(0)
+        self.tableView__displayu = QtWidgets.QTableView(self.tab__displayu)
+        self.tableView__displayu.setGeometry(QtCore.QRect(10, 10, 151, 451))
+        self.tableView__displayu.setObjectName("tableView__displayu")
         self.tabWidget__left.addTab(self.tab__displayu, "")
         self.gridLayout.addWidget(self.tabWidget__left, 0, 0, 1, 1)
         self.tabWidget__right = QtWidgets.QTabWidget(self.centralwidget)
@@ -57,23 +53,39 @@ class Ui_MainWindow(object):
         self.tabWidget__right.addTab(self.tab__displayGraph, "")
         self.tab__displayConnProb = QtWidgets.QWidget()
         self.tab__displayConnProb.setObjectName("tab__displayConnProb")
-        self.tableWidget__displayConnProb = QtWidgets.QTableWidget(self.tab__displayConnProb)
-        self.tableWidget__displayConnProb.setGeometry(QtCore.QRect(10, 10, 541, 451))
-        self.tableWidget__displayConnProb.setObjectName("tableWidget__displayConnProb")
-        self.tableWidget__displayConnProb.setColumnCount(0)
-        self.tableWidget__displayConnProb.setRowCount(0)
+        self.tableView__displayConnProb = QtWidgets.QTableView(self.tab__displayConnProb)
+        self.tableView__displayConnProb.setGeometry(QtCore.QRect(10, 10, 541, 451))
+        self.tableView__displayConnProb.setObjectName("tableView__displayConnProb")
         self.tabWidget__right.addTab(self.tab__displayConnProb, "")
         self.tab__displayConnPower = QtWidgets.QWidget()
         self.tab__displayConnPower.setObjectName("tab__displayConnPower")
-        self.tableWidget__displayConnPower = QtWidgets.QTableWidget(self.tab__displayConnPower)
-        self.tableWidget__displayConnPower.setGeometry(QtCore.QRect(10, 10, 541, 451))
-        self.tableWidget__displayConnPower.setObjectName("tableWidget__displayConnPower")
-        self.tableWidget__displayConnPower.setColumnCount(0)
-        self.tableWidget__displayConnPower.setRowCount(0)
+        self.tableView__displayConnPower = QtWidgets.QTableView(self.tab__displayConnPower)
+        self.tableView__displayConnPower.setGeometry(QtCore.QRect(10, 10, 541, 451))
+        self.tableView__displayConnPower.setObjectName("tableView__displayConnPower")
         self.tabWidget__right.addTab(self.tab__displayConnPower, "")
+        self.tab__displayHeatmap = QtWidgets.QWidget()
+        self.tab__displayHeatmap.setObjectName("tab__displayHeatmap")
+        self.comboBox__heatmapSelect = QtWidgets.QComboBox(self.tab__displayHeatmap)
+        self.comboBox__heatmapSelect.setGeometry(QtCore.QRect(10, 10, 221, 22))
+        self.comboBox__heatmapSelect.setObjectName("comboBox__heatmapSelect")
+        self.comboBox__heatmapSelect.addItem("")
+        self.comboBox__heatmapSelect.addItem("")
+        self.widget__displayHeatmap = MplWidget(self.tab__displayHeatmap)
+        self.widget__displayHeatmap.setGeometry(QtCore.QRect(10, 40, 541, 421))
+        sizePolicy = QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Expanding)
+        sizePolicy.setHorizontalStretch(0)
+        sizePolicy.setVerticalStretch(0)
+        sizePolicy.setHeightForWidth(self.widget__displayHeatmap.sizePolicy().hasHeightForWidth())
+        self.widget__displayHeatmap.setSizePolicy(sizePolicy)
+        self.widget__displayHeatmap.setObjectName("widget__displayHeatmap")
+        self.tabWidget__right.addTab(self.tab__displayHeatmap, "")
         self.gridLayout.addWidget(self.tabWidget__right, 0, 1, 1, 1)
         self.horizontalLayout = QtWidgets.QHBoxLayout()
         self.horizontalLayout.setObjectName("horizontalLayout")
+        self.pushButton__play = QtWidgets.QPushButton(self.centralwidget)
+        self.pushButton__play.setCheckable(True)
+        self.pushButton__play.setObjectName("pushButton__play")
+        self.horizontalLayout.addWidget(self.pushButton__play)
         self.horizontalSlider__currentTime = QtWidgets.QSlider(self.centralwidget)
         self.horizontalSlider__currentTime.setOrientation(QtCore.Qt.Horizontal)
         self.horizontalSlider__currentTime.setObjectName("horizontalSlider__currentTime")
@@ -82,6 +94,12 @@ class Ui_MainWindow(object):
         self.spinBox__currentTime.setMinimumSize(QtCore.QSize(30, 0))
         self.spinBox__currentTime.setObjectName("spinBox__currentTime")
         self.horizontalLayout.addWidget(self.spinBox__currentTime)
+        self.spinBox__fps = QtWidgets.QSpinBox(self.centralwidget)
+        self.spinBox__fps.setMinimum(1)
+        self.spinBox__fps.setMaximum(60)
+        self.spinBox__fps.setProperty("value", 10)
+        self.spinBox__fps.setObjectName("spinBox__fps")
+        self.horizontalLayout.addWidget(self.spinBox__fps)
         self.comboBox__layoutSelect = QtWidgets.QComboBox(self.centralwidget)
         self.comboBox__layoutSelect.setObjectName("comboBox__layoutSelect")
         self.comboBox__layoutSelect.addItem("")
@@ -113,6 +131,11 @@ class Ui_MainWindow(object):
         self.tabWidget__right.setTabText(self.tabWidget__right.indexOf(self.tab__displayGraph), _translate("MainWindow", "Граф"))
         self.tabWidget__right.setTabText(self.tabWidget__right.indexOf(self.tab__displayConnProb), _translate("MainWindow", "Вероятности соединения"))
         self.tabWidget__right.setTabText(self.tabWidget__right.indexOf(self.tab__displayConnPower), _translate("MainWindow", "Силы соединения"))
+        self.comboBox__heatmapSelect.setItemText(0, _translate("MainWindow", "Вероятности соединения"))
+        self.comboBox__heatmapSelect.setItemText(1, _translate("MainWindow", "Силы соединения"))
+        self.tabWidget__right.setTabText(self.tabWidget__right.indexOf(self.tab__displayHeatmap), _translate("MainWindow", "Тепловая карта"))
+        self.pushButton__play.setText(_translate("MainWindow", "Воспроизвести"))
+        self.spinBox__fps.setSuffix(_translate("MainWindow", " кадр/с"))
         self.comboBox__layoutSelect.setItemText(0, _translate("MainWindow", "Декартова плоскость"))
         self.comboBox__layoutSelect.setItemText(1, _translate("MainWindow", "Планарный вид"))
         self.comboBox__layoutSelect.setItemText(2, _translate("MainWindow", "Круговой вид"))
@@ -0,0 +1,213 @@
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+import numpy as np
+import storage
+from core import StructureBuilder, Tree, Utils
+from scenario import DIM
+
+# Bigger histories are kept in memory mapped temporary file instead of RAM
+DEFAULT_IN_MEMORY_LIMIT = 512 * 2**20  # bytes
+# Connection mxs of that many moments are kept in lazy mode
+DEFAULT_CACHE_SIZE = 64
+
+
+class History:
+    '''
+    All moments of multiagent system in preallocated (time, ...) arrays:
+        `coords`, `controls`             -- (time, n, 2)
+        `A`, `B`                         -- (time, n, 2, 2)
+        `conn_probs`                     -- (time, n, n) connection probability mxs (None in lazy mode)
+        `parents`, `weights`             -- (time, n) trees: master of every node (-1 for roots)
+                                            and connection power to it
+        `built`                          -- (time,) moments which trees are built
+    Connection power mxs are not stored, they are calculated from connection probability on demand.
+    With `filename` (or if arrays are bigger than `in_memory_limit` bytes) arrays are kept
+    in memory mapped file (see `storage`), so only the used moments are in RAM.
+    In `lazy` mode `build` only remembers settings: moment is calculated on first access
+    (`conn_prob`, `tree`) and its connection probability mx is kept in LRU cache of `cache_size` moments.
+    Moments may be calculated in background thread (e.g. ahead of playback) while they are shown.
+    Ready `arrays` (by names, e.g. read-only memory maps of loaded scenario) are used as they are
+    instead of new ones; if `parents` and `weights` are among them, trees are not built (`given_trees`)
+    '''
+    def __init__(self, time, nodes_amount, filename=None, in_memory_limit=DEFAULT_IN_MEMORY_LIMIT, lazy=False, cache_size=DEFAULT_CACHE_SIZE, arrays=None):
+        self.time = time
+        self.nodes_amount = nodes_amount
+        self.lazy = lazy
+        self.cache_size = cache_size
+        self.builder = StructureBuilder()
+        shapes = {
+            'coords': ((time, nodes_amount, DIM), float),
+            'controls': ((time, nodes_amount, DIM), float),
+            'A': ((time, nodes_amount, DIM, DIM), float),
+            'B': ((time, nodes_amount, DIM, DIM), float),
+            'conn_probs': ((time, nodes_amount, nodes_amount), float),
+            'parents': ((time, nodes_amount), int),
+            'weights': ((time, nodes_amount), float),
+        }
+        if lazy:
+            del shapes['conn_probs']
+            self.conn_probs = None
+        arrays = arrays or {}
+        self.given_trees = 'parents' in arrays and 'weights' in arrays
+        for name, array in arrays.items():
+            del shapes[name]
+            setattr(self, name, array)
+        size = sum(int(np.prod(shape)) * np.dtype(dtype).itemsize for shape, dtype in shapes.values())
+        self._temporary = filename is None and size > in_memory_limit
+        if self._temporary:
+            fd, filename = tempfile.mkstemp(suffix='.mhb')
+            os.close(fd)
+        self.filename = filename
+        if filename is None:
+            created = {name: np.zeros(shape, dtype=dtype) for name, (shape, dtype) in shapes.items()}
+        else:
+            created = storage.create(filename, shapes)
+        for name, array in created.items():
+            setattr(self, name, array)
+        if self._temporary and os.name == 'posix':
+            # Mapped file lives while its arrays do, so nothing is left on disk even if `close` is never called
+            os.remove(filename)
+            self._temporary = False
+        # Trees are set to roots only until they are built
+        if not self.given_trees:
+            self.parents[...] = -1
+        self.built = np.full(time, self.given_trees)
+        self._settings = None
+        self._given_parents = None
+        self._cache = OrderedDict()
+        # Guards the cache only: moments are calculated without it, so reading of ready ones never waits
+        self._cache_lock = threading.Lock()
+
+    def __len__(self):
+        return self.time
+
+    @classmethod
+    def from_scenario(cls, scenario, **kwargs):
+        '''
+        History of loaded `scenario` which uses its arrays (and trees, if they are built) without copying
+        '''
+        arrays = {'coords': scenario.coords, 'controls': scenario.controls, 'A': scenario.A, 'B': scenario.B}
+        if scenario.parents is not None and scenario.weights is not None:
+            arrays.update(parents=scenario.parents, weights=scenario.weights)
+        return cls(len(scenario.coords), scenario.nodes_amount, arrays=arrays, **kwargs)
+
+    def set_agents(self, coords, controls, A, B):
+        '''
+        Set coords, controls, A, B for all moments ((time, n, ...) arrays or broadcastable to them)
+        '''
+        self.coords[...] = coords
+        self.controls[...] = controls
+        self.A[...] = A
+        self.B[...] = B
+
+    def build(self, rolow, roupp, func, parents=None, **kwargs):
+        '''
+        Calculate connection probability mxs and build trees for all moments
+        (`kwargs` are passed to `StructureBuilder.build_trees`). Trees given by `parents`
+        ((time, n) array) are taken as they are, `given_trees` are kept. In lazy mode nothing
+        is calculated here
+        '''
+        for built in self.iter_build(rolow, roupp, func, parents, **kwargs):
+            pass
+
+    def iter_build(self, rolow, roupp, func, parents=None, chunk=None, **kwargs):
+        '''
+        `build` moment after moment: moments are processed in chunks (of `chunk` moments at most)
+        and amount of built moments is yielded after every chunk, so it can be shown or stopped
+        (close the generator then, to release process pool at once).
+        Connection mxs of all moments are never in memory at once (warm start begins anew
+        in every chunk)
+        '''
+        self._settings = (rolow, roupp, func, kwargs)
+        self._given_parents = parents
+        self._cache.clear()
+        self.built[...] = self.given_trees
+        if self.lazy:
+            return
+        chunks = self.builder.build_chunks(
+            self.coords, rolow, roupp, func, chunk=chunk, parents=parents, trees=not self.given_trees, **kwargs
+        )
+        try:
+            for start, stop, cprobs, chunk_parents, chunk_weights in chunks:
+                self.conn_probs[start:stop] = cprobs
+                if not self.given_trees:
+                    self.parents[start:stop] = chunk_parents
+                    self.weights[start:stop] = chunk_weights
+                    self.built[start:stop] = True
+                yield stop
+        finally:
+            # Process pool is released at once when building is stopped
+            chunks.close()
+
+    def conn_prob(self, t):
+        '''
+        Connection probability mx of moment `t`
+        '''
+        if not self.lazy:
+            return np.asarray(self.conn_probs[t])
+        with self._cache_lock:
+            if t in self._cache:
+                self._cache.move_to_end(t)
+                return self._cache[t]
+        rolow, roupp, func, kwargs = self._settings
+        cprob = self.builder.connection_probability(self.coords[t], rolow, roupp, func)
+        with self._cache_lock:
+            self._cache[t] = cprob
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return cprob
+
+    def conn_power(self, t):
+        '''
+        Connection power mx of moment `t`
+        '''
+        return self.builder.connection_power(self.conn_prob(t))
+
+    def tree(self, t):
+        '''
+        Tree of moment `t` (see `Tree.to_networkx` for graph)
+        '''
+        if not self.built[t]:
+            self._build_moment(t)
+        return Tree(self.parents[t], self.weights[t])
+
+    def ready(self, t):
+        '''
+        True if moment `t` is calculated, i.e. it is shown without delay
+        '''
+        if not self.built[t]:
+            return False
+        if not self.lazy:
+            return True
+        with self._cache_lock:
+            return t in self._cache
+
+    def _build_moment(self, t):
+        rolow, roupp, func, kwargs = self._settings
+        kwargs = dict(kwargs)
+        warm_start = self.builder.warm_start_applies(**kwargs)
+        kwargs.pop('warm_start', None)
+        kwargs.pop('workers', None)
+        cpower = self.conn_power(t)
+        if self._given_parents is not None:
+            self.parents[t] = self._given_parents[t]
+        elif warm_start and t > 0 and self.ready(t-1):
+            # Previous moment is calculated, so its tree is repaired (see `StructureBuilder.update_tree`)
+            self.parents[t] = self.builder.update_tree(cpower, self.parents[t-1], self.conn_power(t-1))
+        else:
+            self.parents[t] = self.builder.build_tree(self.conn_prob(t), as_parents=True, **kwargs)
+        self.weights[t] = Utils.tree_weights(self.parents[t], cpower)
+        self.built[t] = True
+
+    def close(self):
+        '''
+        Release arrays (and remove temporary file, if it was created)
+        '''
+        for name in ('coords', 'controls', 'A', 'B', 'conn_probs', 'parents', 'weights'):
+            setattr(self, name, None)
+        self._cache.clear()
+        if self._temporary:
+            os.remove(self.filename)
+            self._temporary = False
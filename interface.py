@@ -1,24 +1,20 @@
+import time
+STARTED = time.perf_counter()  # for startup timing report (`--startup-time` argument)
 import sys
 import pickle
-import networkx as nx
 import numpy as np
-import yaml
 from PyQt5 import QtCore, QtGui, QtWidgets
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_qt5agg import (NavigationToolbar2QT as NavigationToolbar)
-from core import StructureBuilder, Utils
+from core import Utils
+from scenario import (
+    Scenario, DIM, DEFAULT_ROLOW, DEFAULT_ROUPP, DEFAULT_MAX_SUB_NODES, DEFAULT_MAX_TREE_DEPTH,
+    DEFAULT_PROB_DEPENDING, DEFAULT_WORKERS, DEFAULT_WARM_START, DEFAULT_CONTROL,
+    DEFAULT_SINGLE_A, DEFAULT_SINGLE_B, DEFAULT_SMOOTHING_FUNC,
+)
 import forms.main_win as forms_mainwin
-import forms.display_structure as forms_display
-import resources_rc
+# NOTE: display window (with matplotlib and networkx) is imported on first use, see MainWin.display_window
 
 # DEFAULT PARAMETERS
-DIM = 2
 DEFAULT_TIME = 5
-DEFAULT_ROLOW = 5
-DEFAULT_ROUPP = 100
-DEFAULT_MAX_SUB_NODES = 0
-DEFAULT_MAX_TREE_DEPTH = 0
-DEFAULT_PROB_DEPENDING = False
 DEFAULT_NODE_COORDS = [
     [0.0, 0.0],
     [4.0, 0.0],
@@ -30,266 +26,29 @@ DEFAULT_NODE_COORDS = [
     [-5.0, 0.0],
 ]
 DEFAULT_NODES_AMOUNT = len(DEFAULT_NODE_COORDS)
-DEFAULT_CONTROL = [0.0, 0.0]
 DEFAULT_NODE_CONTROLS = [DEFAULT_CONTROL for i in DEFAULT_NODE_COORDS]
-DEFAULT_SINGLE_A = np.eye(DIM).tolist()
 DEFAULT_A = [DEFAULT_SINGLE_A  for i in DEFAULT_NODE_COORDS]
-DEFAULT_SINGLE_B = np.eye(DIM).tolist()
 DEFAULT_B = [DEFAULT_SINGLE_B  for i in DEFAULT_NODE_COORDS]
-DEFAULT_ROUND_DIGIT = 4
-DEFAULT_SMOOTHING_FUNC = 'cos(ax+b)'
-#DEFAULT_SMOOTHING_FUNC = 'exp(b-a)/((x-a)(x-b))'
-
-# Displaying structure window
-class DisplayWin(QtWidgets.QMainWindow):
-    def __init__(self, parent=None):
-        # Base
-        QtWidgets.QWidget.__init__(self, parent)
-        self.ui = forms_display.Ui_MainWindow()
-        self.ui.setupUi(self)
-        # Matplotlib Toolbar
-        self.addToolBar(NavigationToolbar(self.ui.widget__displayGraph.canvas, self))
-        # Vars
-        self.builder = StructureBuilder()
-        self.current_time = 0
-        self.history_A =[]
-        self.history_B =[]
-        self.history_coords = []
-        self.history_controls = []
-        self.history_graphs = []
-        self.history_conn_probs = []
-        self.history_conn_powers = []
-        self.selected_layout = self.ui.comboBox__layoutSelect.currentText()
-        # Connects setup
-        self.initConnects()
-
-    def initConnects(self):
-        self.ui.horizontalSlider__currentTime.valueChanged.connect(self.set_time_by_scrollbar)
-        self.ui.spinBox__currentTime.valueChanged.connect(self.set_time_by_spinbox)
-        self.ui.comboBox__layoutSelect.activated[str].connect(self.set_selected_layout)
-
-    def prepareWidgets(self):
-        self.ui.horizontalSlider__currentTime.setMaximum(self.time - 1)
-        self.ui.spinBox__currentTime.setMaximum(self.time - 1)
-
-    def syncWidgets(self):
-        self.syncNodeCoordsTable()
-        self.syncNodeControlsTable()
-        self.syncConnectionProbsTable()
-        self.syncConnectionPowersTable()
-        self.syncGraph()
-        #print('Overall weight = ', nx.algorithms.tree.branchings.branching_weight(self.history_graphs[self.current_time], default=0))
-
-    def syncNodeCoordsTable(self):
-        # coords
-        self.ui.tableWidget__displayx.setRowCount(self.nodes_amount)
-        self.ui.tableWidget__displayx.setColumnCount(2)
-        self.ui.tableWidget__displayx.setHorizontalHeaderLabels(['x', 'y'])
-        self.ui.tableWidget__displayx.setVerticalHeaderLabels(str(i) for i in range(self.nodes_amount))
-        for i, node in enumerate(self.history_coords[self.current_time]):
-            self.ui.tableWidget__displayx.setItem(i, 0, QtWidgets.QTableWidgetItem(str(round(node[0], DEFAULT_ROUND_DIGIT))))
-            self.ui.tableWidget__displayx.setItem(i, 1, QtWidgets.QTableWidgetItem(str(round(node[1], DEFAULT_ROUND_DIGIT))))
-        self.ui.tableWidget__displayx.resizeColumnsToContents()
-
-    def syncNodeControlsTable(self):
-        self.ui.tableWidget__displayu.setRowCount(self.nodes_amount)
-        self.ui.tableWidget__displayu.setColumnCount(2)
-        self.ui.tableWidget__displayu.setHorizontalHeaderLabels(['x', 'y'])
-        self.ui.tableWidget__displayu.setVerticalHeaderLabels(str(i) for i in range(self.nodes_amount))
-        for i, node in enumerate(self.history_controls[self.current_time]):
-            self.ui.tableWidget__displayu.setItem(i, 0, QtWidgets.QTableWidgetItem(str(round(node[0], DEFAULT_ROUND_DIGIT))))
-            self.ui.tableWidget__displayu.setItem(i, 1, QtWidgets.QTableWidgetItem(str(round(node[1], DEFAULT_ROUND_DIGIT))))
-        self.ui.tableWidget__displayu.resizeColumnsToContents()
-
-    def syncConnectionProbsTable(self):
-        # get adjacency matrix to highlight using nodes
-        adjacency_matrix = nx.to_numpy_array(self.history_graphs[self.current_time])
-        # connection probs
-        self.ui.tableWidget__displayConnProb.setRowCount(self.nodes_amount)
-        self.ui.tableWidget__displayConnProb.setColumnCount(self.nodes_amount)
-        self.ui.tableWidget__displayConnProb.setVerticalHeaderLabels(str(i) for i in range(self.nodes_amount))
-        self.ui.tableWidget__displayConnProb.setHorizontalHeaderLabels(str(i) for i in range(self.nodes_amount))
-        for i in range(self.nodes_amount):
-            for j in range(self.nodes_amount):
-                # Set value of cell
-                self.ui.tableWidget__displayConnProb.setItem(i, j, QtWidgets.QTableWidgetItem(
-                    str(round(self.history_conn_probs[self.current_time][i][j], DEFAULT_ROUND_DIGIT))
-                ))
-                # If it is actual connection, then highlight it
-                if adjacency_matrix[i][j] != 0:
-                    self.ui.tableWidget__displayConnProb.item(i, j).setBackground(QtGui.QColor(100, 200, 100))
-        self.ui.tableWidget__displayConnProb.resizeColumnsToContents()
-
-    def syncConnectionPowersTable(self):
-        # get adjacency matrix to highlight using nodes
-        adjacency_matrix = nx.to_numpy_array(self.history_graphs[self.current_time])
-        # connection powers
-        self.ui.tableWidget__displayConnPower.setRowCount(self.nodes_amount)
-        self.ui.tableWidget__displayConnPower.setColumnCount(self.nodes_amount)
-        self.ui.tableWidget__displayConnPower.setVerticalHeaderLabels(str(i) for i in range(self.nodes_amount))
-        self.ui.tableWidget__displayConnPower.setHorizontalHeaderLabels(str(i) for i in range(self.nodes_amount))
-        for i in range(self.nodes_amount):
-            for j in range(self.nodes_amount):
-                # Set value of cell
-                self.ui.tableWidget__displayConnPower.setItem(i, j, QtWidgets.QTableWidgetItem(
-                    str(round(self.history_conn_powers[self.current_time][i][j], DEFAULT_ROUND_DIGIT))
-                ))
-                # If it is actual connection, then highlight it
-                if adjacency_matrix[i][j] != 0:
-                    self.ui.tableWidget__displayConnPower.item(i, j).setBackground(QtGui.QColor(100, 200, 100))
-        self.ui.tableWidget__displayConnPower.resizeColumnsToContents()
-
-    def syncGraph(self):
-        # graphs
-        self.ui.widget__displayGraph.canvas.axes.clear()
-        # Selecting a layout from self.selected_layout
-        if self.selected_layout == 'Планарный вид':
-            pos = nx.planar_layout(self.history_graphs[self.current_time])
-        elif self.selected_layout == 'Декартова плоскость':
-            pos = self.cartesian_coordinate_layout()
-        elif self.selected_layout == 'Круговой вид':
-            pos = nx.circular_layout(self.history_graphs[self.current_time])
-        elif self.selected_layout == 'Вид оболочки':
-            pos = nx.shell_layout(self.history_graphs[self.current_time])
-        elif self.selected_layout == 'Фрюхтерман-Рейнгольд':
-            pos = nx.spring_layout(self.history_graphs[self.current_time])
-        # Edge labels
-        edge_labels = { (u, v): round(d['weight'], DEFAULT_ROUND_DIGIT) for u, v, d in self.history_graphs[self.current_time].edges(data=True) }
-        # And draw the graph
-        nx.draw_networkx_nodes(
-            self.history_graphs[self.current_time],
-            pos=pos,
-            nodelist=range(1,self.nodes_amount),
-            node_color='#509bff',
-            ax=self.ui.widget__displayGraph.canvas.axes,
-        )
-        nx.draw_networkx_nodes(
-            self.history_graphs[self.current_time],
-            pos=pos,
-            nodelist=[0],
-            node_color='#ff3b3f',
-            ax=self.ui.widget__displayGraph.canvas.axes,
-        )
-        nx.draw_networkx_labels(
-            self.history_graphs[self.current_time],
-            pos=pos,
-            ax=self.ui.widget__displayGraph.canvas.axes,
-        )
-        nx.draw_networkx_edges(
-            self.history_graphs[self.current_time],
-            pos=pos,
-            alpha=0.8,
-            ax=self.ui.widget__displayGraph.canvas.axes,
-        )
-        nx.draw_networkx_edge_labels(
-            self.history_graphs[self.current_time],
-            pos=pos,
-            edge_labels=edge_labels,
-            font_size=9,
-            ax=self.ui.widget__displayGraph.canvas.axes,
-        )
-        #self.ui.widget__displayGraph.canvas.axes.axis('off')
-        self.ui.widget__displayGraph.canvas.axes.figure.tight_layout()
-        self.ui.widget__displayGraph.canvas.draw()
-
-    def build_from_yaml(self):
-        self.history_graphs.clear()
-        self.history_conn_probs.clear()
-        self.history_conn_powers.clear()
-        for curr_coords in self.history_coords:
-            curr_struct = self.build_structure(curr_coords)
-            self.history_graphs.append(curr_struct['graph'])
-            self.history_conn_probs.append(curr_struct['connection_prob'])
-            self.history_conn_powers.append(curr_struct['connection_power'])
-
-    def build_structure_for_ever(self):
-        self.clear_history()
-        curr_coords = self.node_coords
-        curr_controls = self.node_controls
-        curr_A = self.A
-        curr_B = self.B
-        for curr_time in range(self.time):
-            # Building current struct
-            curr_struct = self.build_structure(curr_coords)
-            curr_graph = curr_struct['graph']
-            curr_cprob = curr_struct['connection_prob']
-            curr_cpower = curr_struct['connection_power']
-            # Adding it to history
-            self.history_A.append(curr_A)
-            self.history_B.append(curr_B)
-            self.history_coords.append(curr_coords)
-            self.history_controls.append(curr_controls)
-            self.history_graphs.append(curr_graph)
-            self.history_conn_probs.append(curr_cprob)
-            self.history_conn_powers.append(curr_cpower)
-            # Calculating next coords and controls
-            # A, B
-            # NOTE: placeholder, cause A, B does not change now
-            # coords
-            next_coords = []
-            for inode, coords in enumerate(curr_coords):
-                #npA = np.array(self.A[inode])
-                npA = np.array(curr_A[inode])
-                npX = np.array(coords)
-                tmp = (npA.dot(npX) + curr_controls[inode]).tolist()
-                next_coords.append(tmp)
-            curr_coords = next_coords
-            # controls
-            next_controls = []
-            for inode, controls in enumerate(curr_controls):
-                #npB = np.array(self.B[inode])
-                npB = np.array(curr_B[inode])
-                npU = np.array(controls)
-                #tmp = (npB.dot(npU)).tolist()
-                tmp = npU.tolist()
-                next_controls.append(tmp)
-            curr_controls = next_controls
-
-    def build_structure(self, coords):
-        # Building connection probability matrix
-        conn_prob = self.builder.connection_probability(coords, self.rolow, self.roupp, self.smoothing_function)
-        # Building connection power matrix
-        conn_power = self.builder.connection_power(conn_prob)
-        # And building a tree
-        struct = self.builder.build_tree(
-            cprob=conn_prob,
-            recalculate_probs=self.prob_depending,
-            max_slaves=self.max_sub_nodes,
-            max_depth=self.max_tree_depth
-        )
-        # Result
-        res = {
-            'graph': struct,
-            'connection_prob': conn_prob,
-            'connection_power': conn_power
-        }
-        return res
-
-    def cartesian_coordinate_layout(self):
-        pos = {i: node for i, node in enumerate(self.history_coords[self.current_time])}
-        return pos
-
-    def clear_history(self):
-        self.history_coords.clear()
-        self.history_controls.clear()
-        self.history_graphs.clear()
-        self.history_conn_probs.clear()
-        self.history_conn_powers.clear()
-
-    def set_time_by_scrollbar(self):
-        self.current_time = int(self.ui.horizontalSlider__currentTime.value())
-        self.ui.spinBox__currentTime.setValue(self.current_time)
-        self.syncWidgets()
-
-    def set_time_by_spinbox(self):
-        self.current_time = int(self.ui.spinBox__currentTime.value())
-        self.ui.horizontalSlider__currentTime.setValue(self.current_time)
-        self.syncWidgets()
-
-    def set_selected_layout(self):
-        self.selected_layout = self.ui.comboBox__layoutSelect.currentText()
-        self.syncWidgets()
-
+# Settings which change built structures (trees of display window are saved only if they are the same)
+STRUCTURE_SETTINGS = ('rolow', 'roupp', 'max_sub_nodes', 'max_tree_depth', 'prob_depending', 'smoothing_function')
+
+
+# Saving scenario to .mhb out of GUI thread (its trees are built first, if there are none)
+class SaveThread(QtCore.QThread):
+    def __init__(self, scenario, filename, parent=None):
+        QtCore.QThread.__init__(self, parent)
+        self.scenario = scenario
+        self.filename = filename
+        self.error = None
+
+    def run(self):
+        try:
+            if self.scenario.parents is None:
+                self.scenario.build_tree_arrays()
+            self.scenario.save_binary(self.filename)
+        except Exception as e:
+            # Exception must not escape QThread.run (PyQt aborts then), it is shown by main window
+            self.error = str(e) or type(e).__name__
 
 # Main Window (where you can set params of system)
 class MainWin(QtWidgets.QMainWindow):
@@ -298,12 +57,14 @@ class MainWin(QtWidgets.QMainWindow):
         QtWidgets.QWidget.__init__(self, parent)
         self.ui = forms_mainwin.Ui_MainWindow()
         self.ui.setupUi(self)
-        # other windows
-        self.display_window = DisplayWin()
+        # other windows (created on first use)
+        self._display_window = None
+        self.save_thread = None
         # supported extensions
         self.__supported_ext = {
             'Файл Pickle': '.pcl',
             'YAML файл': '.yaml',
+            'Бинарный файл': '.mhb',
         }
         # Vars
         self.time = DEFAULT_TIME
@@ -313,6 +74,8 @@ class MainWin(QtWidgets.QMainWindow):
         self.max_sub_nodes = DEFAULT_MAX_SUB_NODES
         self.max_tree_depth = DEFAULT_MAX_TREE_DEPTH
         self.prob_depending = DEFAULT_PROB_DEPENDING
+        self.workers = DEFAULT_WORKERS
+        self.warm_start = DEFAULT_WARM_START
         self.node_coords = DEFAULT_NODE_COORDS
         self.node_controls = DEFAULT_NODE_CONTROLS
         self.smoothing_function = DEFAULT_SMOOTHING_FUNC
@@ -327,6 +90,18 @@ class MainWin(QtWidgets.QMainWindow):
         # Connects setup
         self.initConnects()
 
+    def release_history(self):
+        # Temporary file of big history is removed (if display window was opened at all)
+        if self._display_window is not None:
+            self._display_window.clear_history()
+
+    @property
+    def display_window(self):
+        if self._display_window is None:
+            from display import DisplayWin
+            self._display_window = DisplayWin()
+        return self._display_window
+
     def prepareWidgets(self):
         # Title
         self.setWindowTitle('Построение многоагентной среды')
@@ -366,6 +141,8 @@ class MainWin(QtWidgets.QMainWindow):
         self.ui.lineEdit__inputMaxTreeLength.setText(str(self.max_tree_depth))
         self.ui.checkBox__inputProbDepending.setChecked(self.prob_depending)
         self.ui.comboBox__smoothFunc.setCurrentText(self.smoothing_function)
+        self.ui.spinBox__currA.setMaximum(self.nodes_amount - 1)
+        self.ui.spinBox__currB.setMaximum(self.nodes_amount - 1)
         self.syncNodeCoordsTable()
         self.syncNodeControlsTable()
         self.syncTableA()
@@ -427,6 +204,7 @@ class MainWin(QtWidgets.QMainWindow):
         self.ui.tableWidget__inputB.resizeColumnsToContents()
 
     def show_prob_func(self):
+        import matplotlib.pyplot as plt
         calc_amount = 200
         dots = Utils.prob_func_dots(self.smoothing_function, calc_amount, self.rolow, self.roupp)
         plt.plot(dots[0], dots[1])
@@ -517,7 +295,7 @@ class MainWin(QtWidgets.QMainWindow):
         warning_msg.exec_()
 
     def collect_matrices(self):
-        # Collect all inputs from matrices
+        # Collect all inputs from matrices (returns False, if some of them are incorrect)
         # x
         self.node_coords.clear()
         for i in range(self.nodes_amount):
@@ -526,7 +304,7 @@ class MainWin(QtWidgets.QMainWindow):
                 y = float(self.ui.tableWidget__inputx.item(i, 1).text())
             except AttributeError:
                 self.error_message('Введите корректные значения А')
-                return
+                return False
             self.node_coords.append([x, y])
         # u
         self.node_controls.clear()
@@ -536,20 +314,9 @@ class MainWin(QtWidgets.QMainWindow):
                 y = float(self.ui.tableWidget__inputu.item(i, 1).text())
             except AttributeError:
                 self.error_message('Введите корректные значения А')
-                return
+                return False
             self.node_controls.append([x, y])
-
-    def build_structure_silent(self):
-        self.display_window.clear_history()
-        # Pass all params to display window
-        self.pass_common_parameters()
-        self.collect_matrices()
-        self.display_window.node_coords = self.node_coords
-        self.display_window.node_controls = self.node_controls
-        self.display_window.A = self.A
-        self.display_window.B = self.B
-        # Building structures for every time
-        self.display_window.build_structure_for_ever()
+        return True
 
     def pass_common_parameters(self):
         self.display_window.time = self.time
@@ -560,13 +327,16 @@ class MainWin(QtWidgets.QMainWindow):
         self.display_window.max_tree_depth = self.max_tree_depth
         self.display_window.smoothing_function = self.smoothing_function
         self.display_window.prob_depending = self.prob_depending
+        self.display_window.workers = self.workers
+        self.display_window.warm_start = self.warm_start
 
     def build_structure(self):
         self.display_window.clear_history()
         self.display_window.show()
         # Pass all params to display window
         self.pass_common_parameters()
-        self.collect_matrices()
+        if not self.collect_matrices():
+            return
         self.display_window.node_coords = self.node_coords
         self.display_window.node_controls = self.node_controls
         self.display_window.A = self.A
@@ -578,7 +348,8 @@ class MainWin(QtWidgets.QMainWindow):
         self.display_window.syncWidgets()
 
     def save_parameters(self):
-        self.collect_matrices()
+        if not self.collect_matrices():
+            return
         supported_ext_str = ';;'.join('{text} (*{ext})'.format(text=key, ext=val) for key, val in self.__supported_ext.items())
         filename, _ = QtWidgets.QFileDialog.getSaveFileName(self, 'Сохранить', '', supported_ext_str)
         if filename:
@@ -598,14 +369,17 @@ class MainWin(QtWidgets.QMainWindow):
                 'A': self.A,
                 'B': self.B,
                 'smoothing_function': self.smoothing_function,
+                'workers': self.workers,
+                'warm_start': self.warm_start,
                 }
                 with open(filename, 'wb') as f:
                     pickle.dump(data_to_save, f)
             # Text save (saving coords and controls only!!)
             elif ext == 'yaml':
+                import yaml
                 with open(filename, 'w') as f:
-                    # First, we calculate x and u for each time
-                    self.build_structure_silent()
+                    # First, we calculate x and u for each time (structures are not needed)
+                    history_coords, history_controls = Utils.simulate(self.node_coords, self.node_controls, self.A, self.B, self.time)
                     # Then bypassing each time and write x and u
                     to_yaml = dict()
                     # rolow, roupp and smoothing func writing aswell
@@ -617,19 +391,67 @@ class MainWin(QtWidgets.QMainWindow):
                             'max_sub_nodes': self.max_sub_nodes,
                             'max_tree_depth': self.max_tree_depth,
                             'prob_depending': self.prob_depending,
+                            'workers': self.workers,
+                            'warm_start': self.warm_start,
                         }
                     })
                     to_yaml.update({'structure': {
                         t: {
                             'coordinates': {
-                                i: coord for i, coord in enumerate(self.display_window.history_coords[t])
+                                i: coord for i, coord in enumerate(history_coords[t].tolist())
                             },
                             'controls': {
-                                i: control for i, control in enumerate(self.display_window.history_controls[t])
+                                i: control for i, control in enumerate(history_controls[t].tolist())
                             },
                         } for t in range(self.time)
                     } })
                     yaml.dump(to_yaml, f, default_flow_style=False, indent=4)
+            # Binary save (all moments with built trees)
+            elif ext == 'mhb':
+                self.save_binary(filename)
+
+    def save_binary(self, filename):
+        # Structures built in display window are saved as they are, else they are built while saving
+        settings = {name: getattr(self, name) for name in Scenario.SETTINGS}
+        history = self.built_history()
+        if history is not None:
+            scenario = Scenario(
+                history.coords, history.controls, history.A, history.B,
+                parents=history.parents, weights=history.weights, **settings
+            )
+        else:
+            scenario = Scenario.from_initial_state(self.node_coords, self.node_controls, self.A, self.B, self.time, **settings)
+        self.wait_saving()
+        self.save_thread = SaveThread(scenario, filename, parent=self)
+        self.save_thread.finished.connect(self.saving_finished)
+        self.ui.statusbar.showMessage('Сохранение {}...'.format(filename))
+        self.save_thread.start()
+
+    def built_history(self):
+        # History of display window, if all its moments are built from current parameters
+        display = self._display_window
+        if display is None or display.history is None or not display.history.built.all():
+            return None
+        history = display.history
+        if history.time != self.time or any(getattr(display, name) != getattr(self, name) for name in STRUCTURE_SETTINGS):
+            return None
+        initial = (history.coords[0], history.controls[0], history.A[0], history.B[0])
+        if not all(np.array_equal(a, b) for a, b in zip(initial, (self.node_coords, self.node_controls, self.A, self.B))):
+            return None
+        return history
+
+    def saving_finished(self):
+        if self.sender() is not self.save_thread:
+            return
+        self.ui.statusbar.clearMessage()
+        if self.save_thread.error is not None:
+            self.error_message(self.save_thread.error)
+        self.save_thread = None
+
+    def wait_saving(self):
+        # File being saved is completed before the next one (or before exit)
+        if self.save_thread is not None:
+            self.save_thread.wait()
 
     def load_parameters(self):
         supported_ext_str = ';;'.join('{text} (*{ext})'.format(text=key, ext=val) for key, val in self.__supported_ext.items())
@@ -639,20 +461,32 @@ class MainWin(QtWidgets.QMainWindow):
             # Pickle load
             if ext == 'pcl':
                 self.load_from_pickle(filename)
-                self.ui.spinBox__currA.setMaximum(self.nodes_amount - 1)
-                self.ui.spinBox__currB.setMaximum(self.nodes_amount - 1)
                 self.syncWidgets()
             # Text load (no opportunity to change system)
             elif ext == 'yaml':
                 self.display_window.clear_history()
                 try:
-                    self.load_from_yaml(filename)
+                    scenario = self.load_from_yaml(filename)
                 except Exception as e:
                     #self.error_message(str(e))
                     #return
                     raise
                 self.pass_common_parameters()
-                self.display_window.build_from_yaml()
+                self.display_window.build_from_scenario(scenario)
+                self.display_window.prepareWidgets()
+                self.display_window.show()
+                self.display_window.syncWidgets()
+            # Binary load (memory mapped; trees are not rebuilt if they were saved)
+            elif ext == 'mhb':
+                self.display_window.clear_history()
+                try:
+                    scenario = Scenario.from_binary(filename)
+                except ValueError as e:
+                    self.error_message(str(e))
+                    return
+                self.load_from_scenario(scenario)
+                self.pass_common_parameters()
+                self.display_window.build_from_scenario(scenario)
                 self.display_window.prepareWidgets()
                 self.display_window.show()
                 self.display_window.syncWidgets()
@@ -672,121 +506,49 @@ class MainWin(QtWidgets.QMainWindow):
         self.A = data['A']
         self.B = data['B']
         self.smoothing_function = data['smoothing_function']
+        self.workers = data.get('workers', DEFAULT_WORKERS)
+        self.warm_start = data.get('warm_start', DEFAULT_WARM_START)
 
     def load_from_yaml(self, filename):
-        with open(filename, 'r') as f:
-            loaded_yaml = yaml.safe_load(f)
-            ## MAIN THINGS
-            # Time
-            try:
-                self.time = loaded_yaml['settings']['time']
-            except KeyError:
-                self.time = len(loaded_yaml['structure'])
-                #self.time = DEFAULT_TIME
-            # Nodes amount
-            # TODO: add prtection if not exist key
-            self.nodes_amount = len(loaded_yaml['structure'][0]['coordinates'])
-            # Features
-            try:
-                self.smoothing_function = loaded_yaml['settings']['smoothing_function']
-            except KeyError:
-                self.smoothing_function = DEFAULT_SMOOTHING_FUNC
-            try:
-                self.rolow = loaded_yaml['settings']['rolow']
-            except KeyError:
-                self.rolow = DEFAULT_ROLOW
-            try:
-                self.roupp = loaded_yaml['settings']['roupp']
-            except KeyError:
-                self.roupp = DEFAULT_ROUPP
-            try:
-                self.max_sub_nodes = loaded_yaml['settings']['max_sub_nodes']
-            except KeyError:
-                self.max_sub_nodes = DEFAULT_MAX_SUB_NODES
-            try:
-                self.max_tree_depth = loaded_yaml['settings']['max_tree_depth']
-            except KeyError:
-                self.max_tree_depth = DEFAULT_MAX_TREE_DEPTH
-            try:
-                self.prob_depending = loaded_yaml['settings']['prob_depending']
-            except KeyError:
-                self.prob_depending = DEFAULT_PROB_DEPENDING
-            #
-            ## STRUCTURE
-            for t, vect in loaded_yaml['structure'].items():
-                #print('t = ', t)
-                # A
-                curr_A = []
-                try:
-                    for node, A in sorted(vect['A'].items()):
-                        curr_A.append(A)
-                except KeyError:
-                    if t == 0:
-                        # If t == 0 then set it default for each node (diagonal one)
-                        curr_A = [DEFAULT_SINGLE_A for i in range(self.nodes_amount)]
-                    else:
-                        # else current A's == previous A's
-                        curr_A = self.display_window.history_A[t-1]
-                finally:
-                    self.display_window.history_A.append(curr_A)
-                    #print('curr_A =\n', curr_A)
-                # B
-                curr_B = []
-                try:
-                    for node, B in sorted(vect['B'].items()):
-                        curr_B.append(B)
-                except KeyError:
-                    if t == 0:
-                        # If t == 0 then set it default for each node (diagonal one)
-                        curr_B = [DEFAULT_SINGLE_B for i in range(self.nodes_amount)]
-                    else:
-                        # else current B's == previous B's
-                        curr_B = self.display_window.history_B[t-1]
-                finally:
-                    self.display_window.history_B.append(curr_B)
-                    #print('curr_B =\n', curr_B)
-                # Controls
-                curr_controls = []
-                try:
-                    for node, controls in sorted(vect['controls'].items()):
-                        curr_controls.append(controls)
-                except KeyError:
-                    if t == 0:
-                        curr_controls = [DEFAULT_CONTROL for i in range(self.nodes_amount)]
-                    else:
-                        curr_controls = self.display_window.history_controls[t-1]
-                finally:
-                    self.display_window.history_controls.append(curr_controls)
-                    #print('curr_controls =\n', curr_controls)
-                # Coords
-                curr_coords = []
-                try:
-                    for node, coords in sorted(vect['coordinates'].items()):
-                        curr_coords.append(coords)
-                except KeyError:
-                    if t == 0:
-                        # if we don't found it for 1st t, raise exception
-                        self.error_message('YAML файл не содержит стартовых координат')
-                        raise
-                        # NOTE: actually we can set it by zeroes, but we have to get nodes_amount
-                    else:
-                        # 1. get previous coords
-                        prev_coords = self.display_window.history_coords[t-1]
-                        # 2. calculate new coords basing on prev coords
-                        curr_coords = []
-                        for inode, coords in enumerate(prev_coords):
-                            #npA = np.array(self.display_window.history_A[t][inode])
-                            npA = np.array(self.display_window.history_A[t][inode])
-                            npX = np.array(coords)
-                            tmp = (npA.dot(npX) + self.display_window.history_controls[t][inode]).tolist()
-                            curr_coords.append(tmp)
-                finally:
-                    self.display_window.history_coords.append(curr_coords)
-                    #print('curr_coords =\n', curr_coords)
+        try:
+            scenario = Scenario.from_yaml(filename)
+        except ValueError as e:
+            # if we don't found coords for 1st t
+            self.error_message(str(e))
+            raise
+        self.load_from_scenario(scenario)
+        return scenario
+
+    def load_from_scenario(self, scenario):
+        ## MAIN THINGS
+        self.time = scenario.time
+        self.nodes_amount = scenario.nodes_amount
+        # Initial state of agents (so system can be changed and rebuilt from it)
+        self.node_coords = scenario.coords[0].tolist()
+        self.node_controls = scenario.controls[0].tolist()
+        self.A = scenario.A[0].tolist()
+        self.B = scenario.B[0].tolist()
+        self.current_agent = 0
+        self.current_A = self.A[self.current_agent]
+        self.current_B = self.B[self.current_agent]
+        # Features
+        for name in Scenario.SETTINGS:
+            setattr(self, name, getattr(scenario, name))
+        # Input tables are resized and filled with loaded agents (they are read again on build)
+        self.syncWidgets()
+
+def report_startup_time(imported):
+    print('Startup: imports {:.3f} s, first window {:.3f} s'.format(imported - STARTED, time.perf_counter() - STARTED), file=sys.stderr)
 
 
 if __name__=='__main__':
+    imported = time.perf_counter()
     app = QtWidgets.QApplication(sys.argv)
     myapp = MainWin()
+    app.aboutToQuit.connect(myapp.wait_saving)
+    app.aboutToQuit.connect(myapp.release_history)
     myapp.show()
+    if '--startup-time' in sys.argv:
+        # Reported when event loop is started, i.e. first window is really shown
+        QtCore.QTimer.singleShot(0, lambda: report_startup_time(imported))
     sys.exit(app.exec_())
@@ -0,0 +1,99 @@
+'''
+Positions of agents for drawing of their trees (layouts of DisplayWin) with cache of calculated ones.
+'''
+import threading
+from collections import OrderedDict
+import numpy as np
+import networkx as nx
+
+# Layouts (by names in DisplayWin combobox)
+CARTESIAN = 'Декартова плоскость'
+PLANAR = 'Планарный вид'
+CIRCULAR = 'Круговой вид'
+SHELL = 'Вид оболочки'
+SPRING = 'Фрюхтерман-Рейнгольд'
+# These layouts depend on amount of nodes only, not on the tree
+TREE_INDEPENDENT = (CIRCULAR, SHELL)
+# Positions of that many (moment, layout) pairs are kept
+DEFAULT_CACHE_SIZE = 256
+# Spring layout iterations: from scratch and from positions of neighbour moment
+SPRING_ITERATIONS = 50
+SPRING_WARM_ITERATIONS = 10
+
+
+class LayoutCache:
+    '''
+    Positions ((n, 2) arrays) of nodes by (moment, layout), calculated on first request.
+    Spring layout starts from positions of neighbour (or last drawn) moment, so it converges
+    in few iterations and nodes don't jump from moment to moment.
+    Positions may be calculated in background thread while cached ones are read
+    '''
+    def __init__(self, size=DEFAULT_CACHE_SIZE):
+        self.size = size
+        self._positions = OrderedDict()
+        self._last_spring = None
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._positions.clear()
+        self._last_spring = None
+
+    def get(self, t, layout, tree, coords=None):
+        '''
+        Positions of nodes of `tree` (moment `t`) in `layout`; `coords` are used for cartesian one
+        '''
+        if layout == CARTESIAN:
+            return np.asarray(coords, dtype=float)
+        key = self._key(t, layout)
+        with self._lock:
+            if key in self._positions:
+                self._positions.move_to_end(key)
+                return self._positions[key]
+        pos = self._calculate(t, layout, tree)
+        with self._lock:
+            self._positions[key] = pos
+            if len(self._positions) > self.size:
+                self._positions.popitem(last=False)
+        return pos
+
+    def ready(self, t, layout):
+        '''
+        True if positions of moment `t` in `layout` are known without calculation
+        '''
+        if layout == CARTESIAN:
+            return True
+        with self._lock:
+            return self._key(t, layout) in self._positions
+
+    @staticmethod
+    def _key(t, layout):
+        return (None if layout in TREE_INDEPENDENT else t, layout)
+
+    def _calculate(self, t, layout, tree):
+        graph = tree.to_networkx()
+        if layout == PLANAR:
+            pos = nx.planar_layout(graph)
+        elif layout == CIRCULAR:
+            pos = nx.circular_layout(graph)
+        elif layout == SHELL:
+            pos = nx.shell_layout(graph)
+        elif layout == SPRING:
+            return self._spring(t, graph)
+        else:
+            raise ValueError('Unknown layout: {}'.format(layout))
+        return np.array([pos[node] for node in range(len(tree))])
+
+    def _spring(self, t, graph):
+        # Neighbour moments are the best start, else the last drawn one
+        start = self._positions.get((t - 1, SPRING))
+        if start is None:
+            start = self._positions.get((t + 1, SPRING))
+        if start is None:
+            start = self._last_spring
+        if start is not None and len(start) == graph.number_of_nodes():
+            pos = nx.spring_layout(graph, pos=dict(enumerate(start)), iterations=SPRING_WARM_ITERATIONS, seed=0)
+        else:
+            pos = nx.spring_layout(graph, iterations=SPRING_ITERATIONS, seed=0)
+        self._last_spring = np.array([pos[node] for node in range(graph.number_of_nodes())])
+        return self._last_spring
@@ -0,0 +1,81 @@
+'''
+Qt table models showing numpy arrays (coords, controls, connection mxs) of DisplayWin.
+Cells are formatted only when view asks for them (i.e. when they are visible), so changing
+of moment costs O(visible cells) whatever the size of arrays.
+'''
+from PyQt5 import QtCore, QtGui
+
+DEFAULT_ROUND_DIGIT = 4
+HIGHLIGHT_COLOR = QtGui.QColor(100, 200, 100)
+
+
+class ArrayModel(QtCore.QAbstractTableModel):
+    '''
+    Read-only model of 2d array; `column_labels` are used as horizontal headers (else column numbers)
+    '''
+    def __init__(self, column_labels=None, round_digit=DEFAULT_ROUND_DIGIT, parent=None):
+        QtCore.QAbstractTableModel.__init__(self, parent)
+        self.array = None
+        self.column_labels = column_labels
+        self.round_digit = round_digit
+
+    def set_array(self, array):
+        '''
+        Show `array` (it is not copied). Returns True if shape is changed (views are reset)
+        '''
+        reset = self.array is None or self.array.shape != array.shape
+        if reset:
+            self.beginResetModel()
+            self.array = array
+            self.endResetModel()
+        else:
+            self.array = array
+            # Views repaint visible cells only
+            self.dataChanged.emit(self.index(0, 0), self.index(self.rowCount() - 1, self.columnCount() - 1))
+        return reset
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if self.array is None or parent.isValid() else self.array.shape[0]
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 0 if self.array is None or parent.isValid() else self.array.shape[1]
+
+    def value(self, row, column):
+        return self.array[row, column]
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == QtCore.Qt.DisplayRole:
+            return str(round(float(self.value(index.row(), index.column())), self.round_digit))
+        return None
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if role != QtCore.Qt.DisplayRole:
+            return None
+        if orientation == QtCore.Qt.Horizontal and self.column_labels is not None:
+            return self.column_labels[section]
+        return str(section)
+
+
+class ConnectionModel(ArrayModel):
+    '''
+    Model of connection mx with connections of tree highlighted
+    (`parents` -- master of every node, see `core.Tree`)
+    '''
+    def __init__(self, round_digit=DEFAULT_ROUND_DIGIT, parent=None):
+        ArrayModel.__init__(self, round_digit=round_digit, parent=parent)
+        self.parents = None
+
+    def set_array(self, array, parents=None):
+        self.parents = parents
+        return ArrayModel.set_array(self, array)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if index.isValid() and role == QtCore.Qt.BackgroundRole:
+            # If it is actual connection, then highlight it
+            if self.parents is not None and self.parents[index.column()] == index.row():
+                return HIGHLIGHT_COLOR
+            return None
+        return ArrayModel.data(self, index, role)
+
@@ -0,0 +1,256 @@
+'''
+Drawing of agents' trees (and their connection mxs) on matplotlib axes without rebuilding
+of figure on every moment.
+'''
+import numpy as np
+from matplotlib.collections import LineCollection
+
+ROOT_COLOR = '#ff3b3f'
+NODE_COLOR = '#509bff'
+NODE_SIZE = 300
+LABEL_FONT_SIZE = 12
+EDGE_LABEL_FONT_SIZE = 9
+EDGE_ALPHA = 0.8
+# Arrow head: its position on edge (from master) and size (part of axes span)
+ARROW_POSITION = 0.75
+ARROW_SIZE = 0.02
+# Free space around nodes (part of their span)
+MARGIN = 0.1
+# Heatmap of connection mx: colormap and marker of tree connections
+HEATMAP_CMAP = 'viridis'
+HEATMAP_EDGE_COLOR = '#ff3b3f'
+HEATMAP_EDGE_SIZE = 20
+# Text is the most expensive artist to draw, and weights of so many edges are unreadable anyway
+# (they are in connection power table), so bigger trees are drawn without edge labels
+MAX_EDGE_LABELS = 100
+
+
+class BlitRenderer:
+    '''
+    Base of renderers: artists returned by `artists` are animated, i.e. they are drawn over saved
+    background (axes, ticks etc.) and blitted, without redrawing of whole figure
+    '''
+    def __init__(self, ax):
+        self.ax = ax
+        self.canvas = ax.figure.canvas
+        self.background = None
+        self.canvas.mpl_connect('draw_event', self._on_draw)
+
+    def artists(self):
+        return []
+
+    def show(self, redraw=False):
+        '''
+        Show changed artists; with `redraw` (e.g. limits changed) whole figure is redrawn
+        '''
+        if redraw or self.background is None:
+            # Artists are drawn in `_on_draw`
+            self.canvas.draw()
+        else:
+            self.canvas.restore_region(self.background)
+            self._draw_artists()
+            self.canvas.blit(self.ax.bbox)
+
+    def _draw_artists(self):
+        for artist in self.artists():
+            self.ax.draw_artist(artist)
+
+    def _on_draw(self, event):
+        # Background (without animated artists) is saved after every full redraw
+        self.background = self.canvas.copy_from_bbox(self.ax.bbox)
+        self._draw_artists()
+
+
+class GraphRenderer(BlitRenderer):
+    '''
+    Draws tree (`core.Tree`) of agents with given positions on `ax`.
+    Artists (nodes, edges, labels) are created once for amount of nodes and only their data
+    is changed from moment to moment. Changed artists are blitted over saved background, so
+    whole figure is redrawn only when axes limits must change (or on resize, zoom etc.)
+    '''
+    def __init__(self, ax, round_digit=4):
+        BlitRenderer.__init__(self, ax)
+        self.round_digit = round_digit
+        self.nodes = None
+        self.edges = None
+        self.labels = []
+        self.edge_labels = []
+        # Edge labels may be switched off (e.g. while playing, they can't be read anyway)
+        self.show_edge_labels = True
+        # Limits set by renderer (if user changed them by toolbar, they are kept)
+        self.limits = None
+        # Limits fixed by `set_view` (nodes are not followed)
+        self.fixed = False
+
+    def artists(self):
+        if self.nodes is None:
+            return []
+        artists = [self.edges, self.nodes] + self.labels
+        if self.show_edge_labels:
+            artists += self.edge_labels
+        return artists
+
+    def reset_view(self):
+        '''
+        Fit axes limits to nodes on next update (e.g. after layout change)
+        '''
+        self.limits = None
+        self.fixed = False
+
+    def set_view(self, low, high):
+        '''
+        Fix axes limits to box from `low` to `high` ((x, y) of corners) with margin, e.g. to keep
+        the same view in every frame of animation (until `reset_view`)
+        '''
+        low, high = np.asarray(low, dtype=float), np.asarray(high, dtype=float)
+        span = np.where(high - low > 0, high - low, 1.0)
+        low, high = low - MARGIN * span, high + MARGIN * span
+        self.ax.set_xlim(low[0], high[0])
+        self.ax.set_ylim(low[1], high[1])
+        self.limits = self.ax.get_xlim() + self.ax.get_ylim()
+        self.fixed = True
+
+    def clear(self):
+        for artist in self.artists() + ([] if self.show_edge_labels else self.edge_labels):
+            artist.remove()
+        self.nodes = None
+        self.edges = None
+        self.labels = []
+        self.edge_labels = []
+        self.limits = None
+
+    def update(self, pos, tree):
+        '''
+        Show `tree` with nodes at `pos` ((n, 2) array)
+        '''
+        pos = np.asarray(pos, dtype=float)
+        if len(self.labels) != len(pos):
+            self._create(len(pos))
+        fitted = self._fit(pos)
+        slaves = np.flatnonzero(tree.parents >= 0)
+        masters = tree.parents[slaves]
+        self.nodes.set_offsets(pos)
+        self.edges.set_segments(self._edge_segments(pos[masters], pos[slaves]))
+        for label, xy in zip(self.labels, pos):
+            label.set_position(xy)
+        if self.show_edge_labels:
+            self._update_edge_labels(pos, masters, slaves, tree.weights[slaves])
+        self.show(redraw=fitted)
+
+    def _update_edge_labels(self, pos, masters, slaves, weights):
+        middles = (pos[masters] + pos[slaves]) / 2
+        weights = np.round(weights, self.round_digit)
+        for label, xy, weight in zip(self.edge_labels, middles, weights):
+            label.set_position(xy)
+            label.set_text(str(weight))
+            label.set_visible(True)
+        for label in self.edge_labels[len(slaves):]:
+            label.set_visible(False)
+
+    def _create(self, nodes_amount):
+        self.clear()
+        ax = self.ax
+        self.edges = ax.add_collection(LineCollection([], colors='k', alpha=EDGE_ALPHA, zorder=1, animated=True))
+        colors = [ROOT_COLOR] + [NODE_COLOR] * (nodes_amount - 1)
+        self.nodes = ax.scatter(np.zeros(nodes_amount), np.zeros(nodes_amount), s=NODE_SIZE, c=colors, zorder=2, animated=True)
+        self.labels = [
+            ax.text(0, 0, str(node), fontsize=LABEL_FONT_SIZE, ha='center', va='center', zorder=3, animated=True, clip_on=True)
+            for node in range(nodes_amount)
+        ]
+        # One label slot for every possible edge (every node has one master at most)
+        self.edge_labels = [] if nodes_amount > MAX_EDGE_LABELS else [
+            ax.text(
+                0, 0, '', fontsize=EDGE_LABEL_FONT_SIZE, ha='center', va='center', zorder=3, animated=True, clip_on=True,
+                bbox=dict(boxstyle='round', ec=(1.0, 1.0, 1.0), fc=(1.0, 1.0, 1.0)),
+            )
+            for node in range(nodes_amount)
+        ]
+        ax.tick_params(axis='both', which='both', bottom=False, left=False, labelbottom=False, labelleft=False)
+
+    def _fit(self, pos):
+        '''
+        Set axes limits to fit `pos`, if renderer owns them and nodes are out of them
+        (or take too little of them). Returns True if limits are changed
+        '''
+        if self.fixed:
+            return False
+        current = self.ax.get_xlim() + self.ax.get_ylim()
+        if self.limits is not None and current != self.limits:
+            # User has zoomed or panned
+            return False
+        low, high = pos.min(axis=0), pos.max(axis=0)
+        span = np.where(high - low > 0, high - low, 1.0)
+        if self.limits is not None:
+            (xmin, xmax, ymin, ymax) = self.limits
+            inside = low[0] >= xmin and high[0] <= xmax and low[1] >= ymin and high[1] <= ymax
+            if inside and (xmax - xmin) < 3 * span[0] and (ymax - ymin) < 3 * span[1]:
+                return False
+        low, high = low - MARGIN * span, high + MARGIN * span
+        self.ax.set_xlim(low[0], high[0])
+        self.ax.set_ylim(low[1], high[1])
+        self.limits = self.ax.get_xlim() + self.ax.get_ylim()
+        return True
+
+    def _edge_segments(self, starts, ends):
+        '''
+        Segments of edges and of their arrow heads (two strokes at ARROW_POSITION of every edge)
+        '''
+        (xmin, xmax), (ymin, ymax) = self.ax.get_xlim(), self.ax.get_ylim()
+        size = ARROW_SIZE * max(xmax - xmin, ymax - ymin)
+        direction = ends - starts
+        length = np.hypot(direction[:, 0], direction[:, 1])[:, np.newaxis]
+        direction = np.divide(direction, length, out=np.zeros_like(direction), where=length > 0)
+        normal = direction[:, ::-1] * [-1, 1]
+        tips = starts + ARROW_POSITION * (ends - starts)
+        left = tips - size * direction + size / 2 * normal
+        right = tips - size * direction - size / 2 * normal
+        return np.concatenate([
+            np.stack([starts, ends], axis=1),
+            np.stack([left, tips], axis=1),
+            np.stack([right, tips], axis=1),
+        ])
+
+
+class HeatmapRenderer(BlitRenderer):
+    '''
+    Draws connection mx (cprob or cpower, values in [0, 1]) as image on `ax` with connections
+    of tree (`core.Tree`) marked over it. Between moments only image data and marks are changed
+    '''
+    def __init__(self, ax):
+        BlitRenderer.__init__(self, ax)
+        self.image = None
+        self.edges = None
+        self.colorbar = None
+
+    def artists(self):
+        if self.image is None:
+            return []
+        return [self.image, self.edges]
+
+    def update(self, matrix, tree):
+        matrix = np.asarray(matrix)
+        redraw = self.image is None or self.image.get_array().shape != matrix.shape
+        if redraw:
+            self._create(matrix)
+        else:
+            self.image.set_data(matrix)
+        # Connection master -> slave is cell (master, slave), i.e. x = slave, y = master
+        slaves = np.flatnonzero(tree.parents >= 0)
+        self.edges.set_offsets(np.column_stack([slaves, tree.parents[slaves]]))
+        self.show(redraw=redraw)
+
+    def _create(self, matrix):
+        for artist in self.artists():
+            artist.remove()
+        ax = self.ax
+        msize = len(matrix)
+        self.image = ax.imshow(matrix, cmap=HEATMAP_CMAP, vmin=0.0, vmax=1.0, interpolation='nearest', animated=True)
+        self.edges = ax.scatter(
+            [], [], s=HEATMAP_EDGE_SIZE, marker='s', facecolors='none', edgecolors=HEATMAP_EDGE_COLOR, animated=True
+        )
+        ax.set_xlim(-0.5, msize - 0.5)
+        ax.set_ylim(msize - 0.5, -0.5)
+        ax.set_xlabel('Подчиненный')
+        ax.set_ylabel('Хозяин')
+        if self.colorbar is None:
+            self.colorbar = ax.figure.colorbar(self.image, ax=ax)
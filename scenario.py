@@ -0,0 +1,356 @@
+import pickle
+import numpy as np
+import storage
+from core import StructureBuilder, Utils
+
+# DEFAULT PARAMETERS
+DIM = 2
+DEFAULT_ROLOW = 5
+DEFAULT_ROUPP = 100
+DEFAULT_MAX_SUB_NODES = 0
+DEFAULT_MAX_TREE_DEPTH = 0
+DEFAULT_PROB_DEPENDING = False
+DEFAULT_WORKERS = 1  # processes to build trees in (1 -- build in main process)
+DEFAULT_WARM_START = False  # repair every tree from previous moment's one (works without features only, pays off for separate groups of agents)
+DEFAULT_CONTROL = [0.0, 0.0]
+DEFAULT_SINGLE_A = np.eye(DIM).tolist()
+DEFAULT_SINGLE_B = np.eye(DIM).tolist()
+DEFAULT_SMOOTHING_FUNC = 'cos(ax+b)'
+#DEFAULT_SMOOTHING_FUNC = 'exp(b-a)/((x-a)(x-b))'
+
+
+class Scenario:
+    '''
+    Multiagent system for all moments of time: settings of structure building and
+    coords, controls, A, B of every agent. Knows nothing about GUI
+        `coords`, `controls`             -- (time, n, 2) arrays
+        `A`, `B`                         -- (time, n, 2, 2) arrays
+        `parents`, `weights`             -- (time, n) arrays of built trees (see `build_tree_arrays`) or None
+    '''
+    # Settings with their default values (names are the same as in config files)
+    SETTINGS = {
+        'rolow': DEFAULT_ROLOW,
+        'roupp': DEFAULT_ROUPP,
+        'max_sub_nodes': DEFAULT_MAX_SUB_NODES,
+        'max_tree_depth': DEFAULT_MAX_TREE_DEPTH,
+        'prob_depending': DEFAULT_PROB_DEPENDING,
+        'smoothing_function': DEFAULT_SMOOTHING_FUNC,
+        'workers': DEFAULT_WORKERS,
+        'warm_start': DEFAULT_WARM_START,
+    }
+
+    def __init__(self, coords, controls, A, B, time=None, parents=None, weights=None, **settings):
+        self.coords = np.asarray(coords, dtype=float)
+        self.controls = np.asarray(controls, dtype=float)
+        self.A = np.asarray(A, dtype=float)
+        self.B = np.asarray(B, dtype=float)
+        self.parents = parents
+        self.weights = weights
+        self.time = len(self.coords) if time is None else time
+        self.nodes_amount = self.coords.shape[1]
+        for name, default in self.SETTINGS.items():
+            setattr(self, name, settings.get(name, default))
+
+    @classmethod
+    def from_initial_state(cls, node_coords, node_controls, A, B, time, **settings):
+        '''
+        Scenario where agents move from `node_coords` by their dynamics
+        (A, B does not change in time)
+        '''
+        coords, controls = Utils.simulate(node_coords, node_controls, A, B, time)
+        A = np.broadcast_to(np.asarray(A, dtype=float), (time,) + np.shape(A))
+        B = np.broadcast_to(np.asarray(B, dtype=float), (time,) + np.shape(B))
+        return cls(coords, controls, A, B, time=time, **settings)
+
+    @classmethod
+    def from_pickle(cls, filename):
+        '''
+        Load scenario from .pcl file (initial state of agents, see `MainWin.save_parameters`)
+        '''
+        with open(filename, 'rb') as f:
+            try:
+                data = pickle.load(f)
+            except (pickle.UnpicklingError, EOFError) as e:
+                raise ValueError('Не удалось прочитать pcl файл: {}'.format(e)) from e
+        settings = {name: data[name] for name in cls.SETTINGS if name in data}
+        return cls.from_initial_state(data['node_coords'], data['node_controls'], data['A'], data['B'], data['time'], **settings)
+
+    @classmethod
+    def from_yaml(cls, filename):
+        '''
+        Load scenario from .yaml file (look on configs/sample_cfg_*.yaml for format).
+        File is parsed as stream of events (by libyaml, if it is available) and
+        `structure` section is read moment by moment into preallocated arrays, so
+        the whole document is never kept in memory
+        '''
+        import yaml
+        try:
+            return cls._from_yaml(filename)
+        except yaml.YAMLError as e:
+            # Broken file is the same error as wrong contents for callers
+            raise ValueError('Не удалось прочитать YAML файл: {}'.format(e)) from e
+
+    @classmethod
+    def _from_yaml(cls, filename):
+        with open(filename, 'r') as f:
+            reader = _YamlReader(f)
+            settings = {}
+            history = None
+            for key in reader.mapping_keys():
+                if key == 'settings':
+                    settings = reader.value() or {}
+                elif key == 'structure':
+                    history = _YamlMoments(settings.get('time'))
+                    # Set is for membership test only (list would make loading quadratic in time)
+                    moments = set()
+                    last = None
+                    for t in reader.mapping_keys():
+                        if moments and t == last:
+                            # Repeated moment overrides the previous one (as in yaml.safe_load)
+                            history.pop()
+                        elif t in moments:
+                            raise ValueError('Момент времени {} задан в YAML файле несколько раз'.format(t))
+                        else:
+                            moments.add(t)
+                            last = t
+                        history.append(reader.value(), t)
+                else:
+                    reader.value()
+        if history is None or not len(history):
+            raise ValueError('YAML файл не содержит стартовых координат')
+        coords, controls, A, B = history.arrays()
+        return cls(
+            coords, controls, A, B,
+            time=settings.get('time', len(coords)),
+            **{name: settings[name] for name in cls.SETTINGS if name in settings}
+        )
+
+    @classmethod
+    def from_binary(cls, filename, mmap=True):
+        '''
+        Load scenario (and its trees, if they were saved) from .mhb file (see `storage`).
+        If `mmap`, arrays are memory mapped and read from disk only when used
+        '''
+        arrays, settings = storage.load(filename, mmap=mmap)
+        missing = [name for name in ('coords', 'controls', 'A', 'B') if name not in arrays]
+        if missing:
+            raise ValueError('Файл {} не содержит массивов: {}'.format(filename, ', '.join(missing)))
+        return cls(
+            arrays['coords'], arrays['controls'], arrays['A'], arrays['B'],
+            time=settings.get('time'),
+            parents=arrays.get('parents'),
+            weights=arrays.get('weights'),
+            **{name: settings[name] for name in cls.SETTINGS if name in settings}
+        )
+
+    def save_binary(self, filename):
+        '''
+        Save scenario (and its trees, if they are built) to .mhb file
+        '''
+        settings = {name: getattr(self, name) for name in self.SETTINGS}
+        settings['time'] = self.time
+        storage.save(filename, {
+            'coords': self.coords,
+            'controls': self.controls,
+            'A': self.A,
+            'B': self.B,
+            'parents': self.parents,
+            'weights': self.weights,
+        }, settings)
+
+    @classmethod
+    def load(cls, filename):
+        '''
+        Load scenario from file of any supported format (by extension)
+        '''
+        ext = filename.split('.')[-1]
+        if ext == 'pcl':
+            return cls.from_pickle(filename)
+        elif ext == 'yaml':
+            return cls.from_yaml(filename)
+        elif ext == 'mhb':
+            return cls.from_binary(filename)
+        raise ValueError('Unsupported file format: {}'.format(filename))
+
+    def build(self, builder=None, **kwargs):
+        '''
+        Build connection mxs and trees for all moments.
+        Returns (cprobs, cpowers, trees); `kwargs` are passed to `StructureBuilder.build_trees`.
+        Both (time, n, n) stacks are kept in memory, use `build_tree_arrays` for long scenarios
+        '''
+        builder = builder or StructureBuilder()
+        cprobs, cpowers = builder.batch_connection_matrices(self.coords, self.rolow, self.roupp, self.smoothing_function)
+        trees = builder.build_trees(cprobs, **self._build_settings(kwargs))
+        return cprobs, cpowers, trees
+
+    def build_tree_arrays(self, builder=None, conn_probs=None, chunk=None, sparse=False, **kwargs):
+        '''
+        Build trees for all moments and keep them in `parents` (master of every node, -1 for roots)
+        and `weights` (connection power of every node to its master). Moments are processed in
+        chunks (of `chunk` moments at most), so connection mxs of all moments are never in memory
+        at once; connection probability mxs are written to `conn_probs` ((time, n, n) array, e.g.
+        memory map of `storage.create`), if it is given (see `StructureBuilder.build_chunks`).
+        If `sparse`, connection mxs keep only pairs closer than `roupp` (requires scipy), so
+        memory is proportional to them instead of n**2 (it pays off for spread agents)
+        '''
+        builder = builder or StructureBuilder()
+        time, nodes_amount = len(self.coords), self.nodes_amount
+        self.parents = np.empty((time, nodes_amount), dtype=int)
+        self.weights = np.empty((time, nodes_amount))
+        chunks = builder.build_chunks(
+            self.coords, self.rolow, self.roupp, self.smoothing_function, chunk=chunk, sparse=sparse, **self._build_settings(kwargs)
+        )
+        for start, stop, cprobs, parents, weights in chunks:
+            if conn_probs is not None:
+                for t, cprob in enumerate(cprobs, start):
+                    conn_probs[t] = cprob.toarray() if sparse else cprob
+            self.parents[start:stop] = parents
+            self.weights[start:stop] = weights
+
+    def _build_settings(self, kwargs):
+        # Arguments of `StructureBuilder.build_trees` from settings of scenario (`kwargs` override them)
+        settings = dict(
+            workers=self.workers,
+            warm_start=self.warm_start,
+            recalculate_probs=self.prob_depending,
+            max_slaves=self.max_sub_nodes,
+            max_depth=self.max_tree_depth,
+        )
+        settings.update(kwargs)
+        return settings
+
+
+class _YamlReader:
+    '''
+    Pull reader of YAML events: values are built only for the parts of document
+    which are asked for
+    '''
+    def __init__(self, stream):
+        import yaml
+        self.yaml = yaml
+        # libyaml (C) parser is much faster than pure python one
+        loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+        self.events = yaml.parse(stream, Loader=loader)
+        self.resolver = yaml.resolver.Resolver()
+        self.constructor = yaml.constructor.SafeConstructor()
+        # Skip to the top value of the first document
+        for event in self.events:
+            if isinstance(event, yaml.DocumentStartEvent):
+                break
+
+    def mapping_keys(self):
+        '''
+        Keys of the next mapping; value of each key must be read (`value`) before the next one.
+        If the next value is not a mapping (e.g. empty), it is skipped and there are no keys
+        '''
+        event = next(self.events)
+        if not isinstance(event, self.yaml.MappingStartEvent):
+            self._build(event)
+            return
+        yield from self._keys()
+
+    def _keys(self):
+        for event in self.events:
+            if isinstance(event, self.yaml.MappingEndEvent):
+                return
+            yield self._build(event)
+
+    def value(self):
+        return self._build(next(self.events))
+
+    def _build(self, event):
+        yaml = self.yaml
+        if isinstance(event, yaml.ScalarEvent):
+            return self._scalar(event)
+        elif isinstance(event, yaml.MappingStartEvent):
+            mapping = {}
+            for key in self._keys():
+                mapping[key] = self.value()
+            return mapping
+        elif isinstance(event, yaml.SequenceStartEvent):
+            sequence = []
+            for item in self.events:
+                if isinstance(item, yaml.SequenceEndEvent):
+                    return sequence
+                sequence.append(self._build(item))
+        raise ValueError('Unsupported YAML construction: {}'.format(event))
+
+    def _scalar(self, event):
+        tag = self.resolver.resolve(self.yaml.ScalarNode, event.value, event.implicit)
+        # Fast path for the most common scalars
+        try:
+            if tag == 'tag:yaml.org,2002:float':
+                return float(event.value)
+            elif tag == 'tag:yaml.org,2002:int':
+                return int(event.value)
+        except ValueError:
+            pass
+        return self.constructor.construct_object(self.yaml.ScalarNode(tag, event.value))
+
+
+class _YamlMoments:
+    '''
+    Coords, controls, A, B of scenario moments, growing moment by moment.
+    Arrays are preallocated for `time` moments (if it is known) and doubled when full
+    '''
+    def __init__(self, time=None):
+        self.capacity = time or 16
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def pop(self):
+        self.size -= 1
+
+    def append(self, vect, moment=None):
+        '''
+        Add moment `vect` (its name in file is `moment`, for error messages)
+        '''
+        vect = vect or {}
+        moment = self.size if moment is None else moment
+        t = self.size
+        if t == 0 and not hasattr(self, 'coords'):
+            if 'coordinates' not in vect:
+                raise ValueError('YAML файл не содержит стартовых координат')
+            nodes_amount = len(vect['coordinates'])
+            self.coords = np.empty((self.capacity, nodes_amount, DIM))
+            self.controls = np.empty((self.capacity, nodes_amount, DIM))
+            self.A = np.empty((self.capacity, nodes_amount, DIM, DIM))
+            self.B = np.empty((self.capacity, nodes_amount, DIM, DIM))
+        elif t == self.capacity:
+            self.capacity *= 2
+            for name in ('coords', 'controls', 'A', 'B'):
+                array = getattr(self, name)
+                grown = np.empty((self.capacity,) + array.shape[1:])
+                grown[:t] = array
+                setattr(self, name, grown)
+        # A, B, controls: if not set, at t == 0 they are default, else the same as previous
+        self._set(self.A, t, vect, 'A', DEFAULT_SINGLE_A, moment)
+        self._set(self.B, t, vect, 'B', DEFAULT_SINGLE_B, moment)
+        self._set(self.controls, t, vect, 'controls', DEFAULT_CONTROL, moment)
+        # Coords: if not set, they are calculated basing on prev coords
+        if 'coordinates' in vect:
+            self.coords[t] = self._values(vect, 'coordinates', len(self.coords[t]), moment)
+        else:
+            self.coords[t] = Utils.next_coords(self.A[t], self.coords[t-1], self.controls[t])
+        self.size += 1
+
+    @classmethod
+    def _set(cls, array, t, vect, key, default, moment):
+        if key in vect:
+            array[t] = cls._values(vect, key, len(array[t]), moment)
+        elif t > 0:
+            array[t] = array[t-1]
+        else:
+            array[t] = default
+
+    @staticmethod
+    def _values(vect, key, nodes_amount, moment):
+        # Values of all agents are required: a single row would be broadcast to every agent silently
+        if len(vect[key]) != nodes_amount:
+            raise ValueError('Момент времени {}: {} заданы для {} агентов из {}'.format(moment, key, len(vect[key]), nodes_amount))
+        return [value for node, value in sorted(vect[key].items())]
+
+    def arrays(self):
+        return self.coords[:self.size], self.controls[:self.size], self.A[:self.size], self.B[:self.size]
@@ -0,0 +1,122 @@
+'''
+Compact binary container for scenarios and results (.mhb).
+
+File layout:
+    MAGIC                        -- 8 bytes
+    header length                -- little endian uint64
+    header                       -- utf-8 JSON: {'settings': {...}, 'arrays': {name: {'dtype', 'shape', 'offset'}}}
+    arrays                       -- raw C-ordered data of every array, each starting at ALIGN bytes boundary
+
+Arrays are read with `np.memmap`, so opening of a file is instant whatever its size
+and only the pieces which are really used (e.g. viewed moments) are read from disk.
+'''
+import os
+import json
+import struct
+import tempfile
+import numpy as np
+
+MAGIC = b'MLHIER\x00\x01'
+ALIGN = 64
+
+
+def _aligned(offset):
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+def create(filename, arrays, settings=None):
+    '''
+    Create file for arrays described by `arrays` (dict name -> (shape, dtype)) and return
+    dict of writable memory maps of them (zero filled). Use it to fill large arrays
+    piece by piece without keeping them in memory
+    '''
+    layout = {}
+    offset = 0
+    for name, (shape, dtype) in arrays.items():
+        dtype = np.dtype(dtype)
+        layout[name] = {'dtype': dtype.str, 'shape': list(shape), 'offset': offset}
+        offset = _aligned(offset + int(np.prod(shape)) * dtype.itemsize)
+    header = json.dumps({'settings': settings or {}, 'arrays': layout}).encode('utf-8')
+    # Data starts at aligned position too, so offsets in header are relative to it
+    data_start = _aligned(len(MAGIC) + 8 + len(header))
+    with open(filename, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        f.truncate(data_start + offset)
+    maps = {}
+    for name, description in layout.items():
+        dtype = np.dtype(description['dtype'])
+        shape = tuple(description['shape'])
+        if 0 in shape:
+            # np.memmap can't map empty arrays
+            maps[name] = np.zeros(shape, dtype=dtype)
+        else:
+            maps[name] = np.memmap(filename, dtype=dtype, mode='r+', offset=data_start + description['offset'], shape=shape)
+    return maps
+
+
+def save(filename, arrays, settings=None):
+    '''
+    Write `arrays` (dict name -> array) and `settings` (JSON serializable dict) to `filename`.
+    File is written next to `filename` and replaces it when complete, so `arrays` may be
+    memory maps of `filename` itself (e.g. loaded scenario saved back)
+    '''
+    arrays = {name: np.asarray(array) for name, array in arrays.items() if array is not None}
+    fd, temporary = tempfile.mkstemp(suffix='.mhb', dir=os.path.dirname(os.path.abspath(filename)))
+    os.close(fd)
+    try:
+        maps = create(temporary, {name: (array.shape, array.dtype) for name, array in arrays.items()}, settings)
+        for name, array in arrays.items():
+            maps[name][...] = array
+            if isinstance(maps[name], np.memmap):
+                maps[name].flush()
+        # Maps are closed before the file is moved
+        del maps
+        os.replace(temporary, filename)
+    except BaseException:
+        os.remove(temporary)
+        raise
+
+
+def load(filename, mmap=True):
+    '''
+    Read file written by `save`. Returns (arrays, settings); arrays are read-only
+    memory maps if `mmap`, else they are read into memory.
+    Raises ValueError if file is not .mhb or it is damaged (e.g. truncated)
+    '''
+    with open(filename, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('Неизвестный формат файла: {}'.format(filename))
+        length = f.read(8)
+        if len(length) != 8:
+            raise ValueError('Файл поврежден (нет заголовка): {}'.format(filename))
+        header_length, = struct.unpack('<Q', length)
+        file_size = os.fstat(f.fileno()).st_size
+        if len(MAGIC) + 8 + header_length > file_size:
+            raise ValueError('Файл поврежден (заголовок обрезан): {}'.format(filename))
+        header = f.read(header_length)
+    try:
+        # JSON errors (and wrong utf-8) are ValueErrors themselves
+        header = json.loads(header.decode('utf-8'))
+        settings, layout = header['settings'], header['arrays']
+        layout = {
+            name: (np.dtype(description['dtype']), tuple(description['shape']), int(description['offset']))
+            for name, description in layout.items()
+        }
+    except (KeyError, TypeError, AttributeError) as e:
+        raise ValueError('Файл поврежден (неверный заголовок): {}'.format(filename)) from e
+    data_start = _aligned(len(MAGIC) + 8 + header_length)
+    arrays = {}
+    for name, (dtype, shape, offset) in layout.items():
+        offset = data_start + offset
+        if offset + int(np.prod(shape)) * dtype.itemsize > file_size:
+            raise ValueError('Файл поврежден (массив {} обрезан): {}'.format(name, filename))
+        if not mmap or 0 in shape:
+            # np.memmap can't map empty arrays
+            with open(filename, 'rb') as f:
+                f.seek(offset)
+                arrays[name] = np.fromfile(f, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+        else:
+            arrays[name] = np.memmap(filename, dtype=dtype, mode='r', offset=offset, shape=shape)
+    return arrays, settings